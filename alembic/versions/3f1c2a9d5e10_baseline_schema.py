@@ -0,0 +1,102 @@
+"""baseline schema
+
+The schema as it was created by models.Base.metadata.create_all before migrations were introduced.
+Databases created that way are brought under alembic with `alembic stamp 3f1c2a9d5e10`.
+
+Revision ID: 3f1c2a9d5e10
+Revises: 
+Create Date: 2026-10-18 20:19:30.930462
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d5e10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('products',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('sku', sa.String(), nullable=True),
+                    sa.Column('name', sa.String(), nullable=False),
+                    sa.Column('size', sa.String(), nullable=True),
+                    sa.Column('category', sa.String(), nullable=False),
+                    sa.Column('subcategory', sa.String(), nullable=True),
+                    sa.Column('description', sa.String(), nullable=True),
+                    sa.Column('popularity', sa.Integer(), server_default='0', nullable=False),
+                    sa.Column('inventory', sa.Integer(), server_default='0', nullable=False),
+                    sa.Column('cost', sa.Float(), server_default='0', nullable=False),
+                    sa.Column('price', sa.Float(), nullable=False),
+                    sa.Column('image', sa.String(), nullable=True),
+                    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_table('users',
+                    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+                    sa.Column('email', sa.String(), nullable=False),
+                    sa.Column('first_name', sa.String(), nullable=False),
+                    sa.Column('last_name', sa.String(), nullable=False),
+                    sa.Column('phone', sa.String(), nullable=False),
+                    sa.Column('password', sa.String(), nullable=False),
+                    sa.Column('address_line_1', sa.String(), nullable=True),
+                    sa.Column('address_line_2', sa.String(), nullable=True),
+                    sa.Column('city', sa.String(), nullable=True),
+                    sa.Column('state', sa.String(), nullable=True),
+                    sa.Column('zip_code', sa.String(), nullable=True),
+                    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+                    sa.Column('is_admin', sa.Boolean(), server_default='False', nullable=False),
+                    sa.Column('is_verified', sa.Boolean(), server_default='False', nullable=False),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_table('carts',
+                    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('product_id', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+                    sa.Column('quantity', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_table('orders',
+                    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=True),
+                    sa.Column('subtotal', sa.Float(), nullable=False),
+                    sa.Column('total', sa.Float(), nullable=False),
+                    sa.Column('order_type', sa.String(), nullable=False),
+                    sa.Column('status', sa.String(), nullable=False),
+                    sa.Column('first_name', sa.String(), nullable=False),
+                    sa.Column('last_name', sa.String(), nullable=False),
+                    sa.Column('email', sa.String(), nullable=False),
+                    sa.Column('phone', sa.String(), nullable=False),
+                    sa.Column('address_line_1', sa.String(), nullable=True),
+                    sa.Column('address_line_2', sa.String(), nullable=True),
+                    sa.Column('city', sa.String(), nullable=True),
+                    sa.Column('state', sa.String(), nullable=True),
+                    sa.Column('zip_code', sa.String(), nullable=True),
+                    sa.Column('schedule', sa.String(), nullable=True),
+                    sa.Column('tip', sa.Float(), nullable=True),
+                    sa.Column('cancel_reason', sa.String(), nullable=True),
+                    sa.Column('reference_id', sa.String(), nullable=True),
+                    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+                    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_table('order_items',
+                    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+                    sa.Column('order_id', sa.Integer(), nullable=False),
+                    sa.Column('product_id', sa.Integer(), nullable=False),
+                    sa.Column('quantity', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+                    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade() -> None:
+    op.drop_table('order_items')
+    op.drop_table('orders')
+    op.drop_table('carts')
+    op.drop_table('users')
+    op.drop_table('products')
@@ -0,0 +1,27 @@
+"""order idempotency fingerprints
+
+Hash of the checkout request that created an order with an Idempotency-Key, a retry must send the same request.
+Orders created before this revision have none, a retry of their checkout is rejected.
+
+Revision ID: 5c0e8f2d7a16
+Revises: e5d83b6a1f29
+Create Date: 2026-10-18 22:41:05.603917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c0e8f2d7a16'
+down_revision = 'e5d83b6a1f29'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('idempotency_fingerprint', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('orders', 'idempotency_fingerprint')
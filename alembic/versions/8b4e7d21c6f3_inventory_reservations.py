@@ -0,0 +1,43 @@
+"""inventory reservations
+
+Units held by placed orders until they complete or are canceled, and the per-product total in products.reserved.
+
+Revision ID: 8b4e7d21c6f3
+Revises: f1a7b43c9d05
+Create Date: 2026-10-18 20:19:31.274756
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e7d21c6f3'
+down_revision = 'f1a7b43c9d05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('products', sa.Column('reserved', sa.Integer(), server_default='0', nullable=False))
+
+    op.create_table('inventory_reservations',
+                    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+                    sa.Column('order_id', sa.Integer(), nullable=False),
+                    sa.Column('product_id', sa.Integer(), nullable=False),
+                    sa.Column('quantity', sa.Integer(), nullable=False),
+                    sa.Column('expires_at', sa.TIMESTAMP(), nullable=True),
+                    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+                    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_inventory_reservations_order_id', 'inventory_reservations', ['order_id'])
+    op.create_index('ix_inventory_reservations_expires_at', 'inventory_reservations', ['expires_at'],
+                    postgresql_where=sa.text('expires_at IS NOT NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_inventory_reservations_expires_at', table_name='inventory_reservations')
+    op.drop_index('ix_inventory_reservations_order_id', table_name='inventory_reservations')
+    op.drop_table('inventory_reservations')
+    op.drop_column('products', 'reserved')
@@ -0,0 +1,37 @@
+"""unique cart rows
+
+One cart row per user and product, which the cart sync upserts on.
+
+Revision ID: a41f6c2e9b80
+Revises: 3f1c2a9d5e10
+Create Date: 2026-10-18 20:19:31.102417
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41f6c2e9b80'
+down_revision = '3f1c2a9d5e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # merge duplicate cart rows into the newest one before making (user_id, product_id) unique:
+    # it gets the quantities of all of them, then the older ones are deleted
+    op.execute("""
+        UPDATE carts c SET quantity = duplicates.quantity
+        FROM (SELECT max(id) AS id, sum(quantity) AS quantity FROM carts
+              GROUP BY user_id, product_id HAVING count(*) > 1) duplicates
+        WHERE c.id = duplicates.id
+    """)
+    op.execute("""
+        DELETE FROM carts c USING carts newer
+        WHERE c.user_id = newer.user_id AND c.product_id = newer.product_id AND c.id < newer.id
+    """)
+    op.create_unique_constraint('carts_user_id_product_id_key', 'carts', ['user_id', 'product_id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('carts_user_id_product_id_key', 'carts', type_='unique')
@@ -0,0 +1,30 @@
+"""delivery distance cache
+
+Distances from the store by normalized address, see delivery.check_addr_within_range.
+
+Revision ID: b7d20e5c13a4
+Revises: a41f6c2e9b80
+Create Date: 2026-10-18 20:19:31.151930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d20e5c13a4'
+down_revision = 'a41f6c2e9b80'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('delivery_distances',
+                    sa.Column('address', sa.String(), nullable=False),
+                    sa.Column('distance_miles', sa.Float(), nullable=True),
+                    sa.Column('checked_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+                    sa.PrimaryKeyConstraint('address'))
+
+
+def downgrade() -> None:
+    op.drop_table('delivery_distances')
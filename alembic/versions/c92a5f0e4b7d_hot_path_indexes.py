@@ -0,0 +1,52 @@
+"""hot path indexes
+
+Secondary indexes for the queries the app runs on every request or sweep:
+- users.email, unique: login and registration look users up by email
+- orders (user_id, id DESC) for confirmed/accepted/completed/canceled orders: a customer's order history page
+- orders (status, created_at) for created/placed/error orders: the expired order sweeper
+- order_items.order_id: loading an order's items, reserving and completing its inventory
+carts is already covered by its (user_id, product_id) unique constraint, and products are
+served from the in-memory catalog, so neither gets an index of its own.
+
+The indexes are built with CREATE INDEX CONCURRENTLY, outside of a transaction, so the tables
+stay writable while they build. If a build fails it leaves an INVALID index behind: drop it and run
+the upgrade again. Duplicate user emails have to be resolved before ix_users_email can be built.
+
+Revision ID: c92a5f0e4b7d
+Revises: 8b4e7d21c6f3
+Create Date: 2026-10-18 20:19:31.610962
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c92a5f0e4b7d'
+down_revision = '8b4e7d21c6f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    duplicates = op.get_bind().execute(sa.text(
+        "SELECT email FROM users GROUP BY email HAVING count(*) > 1 LIMIT 10")).scalars().all()
+    if duplicates:
+        raise RuntimeError(f'users share an email, merge them before adding ix_users_email: {duplicates}')
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_email', 'users', ['email'], unique=True, postgresql_concurrently=True)
+        op.create_index('ix_orders_user_history', 'orders', ['user_id', sa.text('id DESC')],
+                        postgresql_where=sa.text("status IN ('confirmed', 'accepted', 'completed', 'canceled')"),
+                        postgresql_concurrently=True)
+        op.create_index('ix_orders_unfinished_created_at', 'orders', ['status', 'created_at'],
+                        postgresql_where=sa.text("status IN ('created', 'placed', 'error')"),
+                        postgresql_concurrently=True)
+        op.create_index('ix_order_items_order_id', 'order_items', ['order_id'], postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_order_items_order_id', table_name='order_items', postgresql_concurrently=True)
+        op.drop_index('ix_orders_unfinished_created_at', table_name='orders', postgresql_concurrently=True)
+        op.drop_index('ix_orders_user_history', table_name='orders', postgresql_concurrently=True)
+        op.drop_index('ix_users_email', table_name='users', postgresql_concurrently=True)
@@ -0,0 +1,41 @@
+"""outbox messages
+
+Messages (order SMS, verification emails) committed together with the change that triggers them,
+sent by the outbox worker.
+
+Revision ID: d3c98a1f7e62
+Revises: b7d20e5c13a4
+Create Date: 2026-10-18 20:19:31.188064
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3c98a1f7e62'
+down_revision = 'b7d20e5c13a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('outbox_messages',
+                    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+                    sa.Column('kind', sa.String(), nullable=False),
+                    sa.Column('recipient', sa.String(), nullable=False),
+                    sa.Column('body', sa.String(), server_default='', nullable=False),
+                    sa.Column('status', sa.String(), server_default='pending', nullable=False),
+                    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+                    sa.Column('next_attempt_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+                    sa.Column('last_error', sa.String(), nullable=True),
+                    sa.Column('sent_at', sa.TIMESTAMP(), nullable=True),
+                    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_outbox_messages_pending', 'outbox_messages', ['next_attempt_at'],
+                    postgresql_where=sa.text("status = 'pending'"))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_outbox_messages_pending', table_name='outbox_messages')
+    op.drop_table('outbox_messages')
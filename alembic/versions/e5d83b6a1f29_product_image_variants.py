@@ -0,0 +1,28 @@
+"""product image variants
+
+The thumb, card and full size variants of a product's ingested image, see images.make_variants.
+Existing images keep working as they are until they are uploaded again.
+
+Revision ID: e5d83b6a1f29
+Revises: c92a5f0e4b7d
+Create Date: 2026-10-18 21:02:47.118304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5d83b6a1f29'
+down_revision = 'c92a5f0e4b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('products', sa.Column('image_variants', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('products', 'image_variants')
@@ -0,0 +1,28 @@
+"""order idempotency keys
+
+The Idempotency-Key a checkout was created with, so that a retried checkout finds its order.
+
+Revision ID: f1a7b43c9d05
+Revises: d3c98a1f7e62
+Create Date: 2026-10-18 20:19:31.231587
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a7b43c9d05'
+down_revision = 'd3c98a1f7e62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('idempotency_key', sa.String(), nullable=True))
+    op.create_unique_constraint('orders_idempotency_key_key', 'orders', ['idempotency_key'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('orders_idempotency_key_key', 'orders', type_='unique')
+    op.drop_column('orders', 'idempotency_key')
@@ -0,0 +1,44 @@
+from fastapi import status, HTTPException, Depends
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi_jwt_auth import AuthJWT
+from .database import get_db
+from . import models
+
+'''
+Access tokens carry the user's role in a signed `is_admin` claim, so admin routes don't look up the user.
+A role change takes effect when the access token is refreshed, i.e. within access_token_expire_minutes.
+'''
+def create_access_token(Authorize: AuthJWT, user: models.User, expires_time):
+    return Authorize.create_access_token(subject=user.id, expires_time=expires_time,
+                                         user_claims={'is_admin': user.is_admin})
+
+def get_current_user_id(Authorize: AuthJWT = Depends()):
+    Authorize.jwt_required()
+    return Authorize.get_jwt_subject()
+
+'''
+Current user, loaded at most once per request: FastAPI caches a dependency's value
+for every route parameter and sub-dependency that asks for it within the same request.
+'''
+async def get_current_user(user_id: int = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(models.User).where(models.User.id == user_id))
+    if user == None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Invalid token or expired token")
+    return user
+
+'''
+Only let admins through, going by the token's `is_admin` claim
+Tokens issued before the claim existed fall back to looking up the user
+Returns the admin's user id
+'''
+async def require_admin(Authorize: AuthJWT = Depends(), db: AsyncSession = Depends(get_db)):
+    Authorize.jwt_required()
+    user_id = Authorize.get_jwt_subject()
+    is_admin = Authorize.get_raw_jwt().get('is_admin')
+    if is_admin == None:
+        is_admin = await db.scalar(select(models.User.is_admin).where(models.User.id == user_id))
+    if not is_admin:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    return user_id
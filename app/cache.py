@@ -0,0 +1,227 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.expression import text
+from collections import OrderedDict
+import asyncpg
+import asyncio
+import bisect
+import threading
+import logging
+import time
+from . import models, schemas
+from .search import SearchIndex
+from .images import image_store, image_url, variant_url
+from .database import DATABASE_DSN
+from .config import settings
+
+CATALOG_CHANNEL = 'catalog_changed'
+CART_CHANNEL = 'cart_changed'
+
+logger = logging.getLogger(__name__)
+
+class CatalogSnapshot:
+    def __init__(self, version, products, categories, images):
+        self.version = version
+        self.products = products
+        self.product_ids = [product.id for product in products]
+        self.categories = categories
+        # product id -> ImageFile, so serving an image needs neither the database nor a stat
+        self.images = images
+        # what the product list endpoints send, converted once per snapshot instead of once per request
+        self.product_dicts = [product.dict() for product in products]
+        self._product_dicts_by_id = dict(zip(self.product_ids, self.product_dicts))
+        self.search_index = SearchIndex(self.products)
+
+    def search(self, query, limit):
+        return [self._product_dicts_by_id[product.id] for product in self.search_index.search(query, limit)]
+
+    def set_inventory(self, product_id, inventory):
+        index = bisect.bisect_left(self.product_ids, product_id)
+        if index < len(self.product_ids) and self.product_ids[index] == product_id:
+            self.products[index].inventory = inventory
+            self.product_dicts[index]['inventory'] = inventory
+
+# the product columns listed in the catalog
+CATALOG_COLUMNS = [models.Product.id, models.Product.name, models.Product.price, models.Product.inventory, models.Product.size,
+                   models.Product.category, models.Product.subcategory, models.Product.description, models.Product.popularity,
+                   models.Product.image, models.Product.image_variants]
+
+'''
+Build a snapshot from the catalog's rows
+Blocking and CPU bound (a few hundred milliseconds for a large catalog), run it in a thread
+'''
+def build_catalog_snapshot(version, rows, categories):
+    images = image_store.lookup_many({row.id: row.image for row in rows if row.image})
+    product_responses = [schemas.ProductResponse.from_orm(row) for row in rows]
+    for row, product_response in zip(rows, product_responses):
+        if row.id in images:
+            product_response.image_url = image_url(row.id, images[row.id])
+        if row.image_variants:
+            product_response.images = {variant: schemas.ImageVariant(url=variant_url(image['file']), width=image['width'], height=image['height'])
+                                       for variant, image in row.image_variants.items()}
+    return CatalogSnapshot(version,
+                           product_responses,
+                           [schemas.CategoryResponse.from_orm(category) for category in categories],
+                           images)
+
+'''
+Versioned in-memory copy of the storefront catalog.
+Every catalog write bumps the version (locally, and in every other worker through
+Postgres NOTIFY), and the next read after a bump reloads the whole catalog once.
+The reload only queries on the event loop, the snapshot is built in a thread so other requests keep being served.
+Inventory changes of a few products (completed orders) don't bump the version, the next read
+patches just those products into the current snapshot.
+'''
+class CatalogCache:
+    def __init__(self):
+        self.version = 0
+        self._snapshot = None
+        self._lock = asyncio.Lock()
+        self._stale_inventory = set()
+
+    def invalidate(self):
+        self.version += 1
+
+    def inventory_changed(self, product_ids):
+        self._stale_inventory.update(product_ids)
+
+    async def get(self, db: AsyncSession) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version and not self._stale_inventory:
+            return snapshot
+        async with self._lock:
+            # another request may have reloaded while we were waiting for the lock
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != self.version:
+                version = self.version
+                rows = (await db.execute(select(*CATALOG_COLUMNS).order_by(models.Product.id))).all()
+                categories = (await db.execute(select(models.Product.category).distinct().order_by(models.Product.category))).all()
+                snapshot = await asyncio.get_running_loop().run_in_executor(None, build_catalog_snapshot, version, rows, categories)
+                self._snapshot = snapshot
+            if self._stale_inventory:
+                # ids that arrive while this query runs stay in the set for the next read
+                product_ids = list(self._stale_inventory)
+                self._stale_inventory.difference_update(product_ids)
+                rows = await db.execute(select(models.Product.id, models.Product.inventory).where(models.Product.id.in_(product_ids)))
+                for product_id, inventory in rows:
+                    snapshot.set_inventory(product_id, inventory)
+        return snapshot
+
+catalog_cache = CatalogCache()
+
+'''
+Per-user cache of cart contents, bounded in size and age.
+An entry is only stored if nothing was invalidated while it was being loaded.
+'''
+class CartCache:
+    def __init__(self, ttl_seconds, max_users):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            items, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return items
+
+    def put(self, user_id, items, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[user_id] = (items, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            self.generation += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+cart_cache = CartCache(settings.cart_cache_ttl_seconds, settings.cart_cache_max_users)
+
+'''
+Notification handler of CATALOG_CHANNEL
+The payload is empty for any change to the catalog, or lists the ids of products whose inventory changed
+'''
+def catalog_changed(payload=None):
+    if payload:
+        catalog_cache.inventory_changed(int(product_id) for product_id in payload.split(','))
+    else:
+        catalog_cache.invalidate()
+    # cached carts embed product details
+    cart_cache.invalidate()
+
+def cart_changed(payload=None):
+    cart_cache.invalidate(int(payload) if payload else None)
+
+'''
+Queue a change notification on the given channel.
+Postgres only delivers it when the surrounding transaction commits, so call this before db.commit().
+'''
+async def notify_change(db: AsyncSession, channel: str, payload: str = ''):
+    await db.execute(text('SELECT pg_notify(:channel, :payload)'), {'channel': channel, 'payload': payload})
+
+'''
+Background task that LISTENs on the change channels and hands every notification to the registered handler,
+so that this worker's caches are invalidated (and its background tasks woken up) when any worker commits a change.
+'''
+class InvalidationListener:
+    def __init__(self):
+        self.handlers = {}
+        self._task = None
+
+    def register(self, channel, handler):
+        self.handlers[channel] = handler
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+            except (OSError, asyncpg.PostgresError):
+                logger.exception('cache invalidation listener lost its connection, reconnecting')
+            await asyncio.sleep(1)
+
+    def _dispatch(self, connection, pid, channel, payload):
+        self.handlers[channel](payload)
+
+    async def _listen(self):
+        conn = await asyncpg.connect(DATABASE_DSN)
+        try:
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda connection: lost.set())
+            for channel in self.handlers:
+                await conn.add_listener(channel, self._dispatch)
+            # notifications may have been missed while we were disconnected
+            for handler in self.handlers.values():
+                handler(None)
+            await lost.wait()
+        finally:
+            await conn.close()
+
+invalidation_listener = InvalidationListener()
+invalidation_listener.register(CATALOG_CHANNEL, catalog_changed)
+invalidation_listener.register(CART_CHANNEL, cart_changed)
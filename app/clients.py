@@ -0,0 +1,108 @@
+import httpx
+import asyncio
+import logging
+import time
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+class UpstreamUnavailable(Exception):
+    pass
+
+'''
+Stops calling an upstream after `failure_threshold` consecutive failures.
+After `reset_seconds` a single trial request is let through: success closes the circuit again,
+failure keeps it open for another `reset_seconds`.
+'''
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_seconds:
+            return False
+        # a trial that never reported back (e.g. its request was cancelled) doesn't block the next one forever
+        if self.trial_started_at is not None and now - self.trial_started_at < self.reset_seconds:
+            return False
+        self.trial_started_at = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_started_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning('circuit opened after %d failures', self.failures)
+            self.opened_at = time.monotonic()
+        self.trial_started_at = None
+
+'''
+Shared, connection-pooled async HTTP client for one upstream API.
+Requests have explicit timeouts, at most `max_concurrency` of them are in flight per worker,
+and a circuit breaker makes calls fail fast while the upstream is failing.
+Raises UpstreamUnavailable when the call was not made or did not complete.
+'''
+class UpstreamClient:
+    def __init__(self, name, timeout, max_concurrency, breaker):
+        self.name = name
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker
+        self._client = None
+        self._slots = None
+
+    def _ensure_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout,
+                                             limits=httpx.Limits(max_connections=self.max_concurrency,
+                                                                 max_keepalive_connections=self.max_concurrency))
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+
+    async def request(self, method, url, **kwargs) -> httpx.Response:
+        self._ensure_client()
+        if not self.breaker.allow():
+            raise UpstreamUnavailable(f'{self.name} circuit is open')
+        try:
+            # waiting for a free slot counts against the same timeout as the request itself
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            raise UpstreamUnavailable(f'{self.name} is saturated')
+        try:
+            response = await self._client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.breaker.record_failure()
+            raise UpstreamUnavailable(f'{self.name} request failed: {e!r}')
+        finally:
+            self._slots.release()
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            raise UpstreamUnavailable(f'{self.name} returned {response.status_code}')
+        self.breaker.record_success()
+        return response
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+maps_client = UpstreamClient('maps',
+                             timeout=settings.maps_timeout_seconds,
+                             max_concurrency=settings.maps_max_concurrency,
+                             breaker=CircuitBreaker(settings.maps_breaker_failures, settings.maps_breaker_reset_seconds))
+
+stripe_client = UpstreamClient('stripe',
+                               timeout=settings.stripe_timeout_seconds,
+                               max_concurrency=settings.stripe_max_concurrency,
+                               breaker=CircuitBreaker(settings.stripe_breaker_failures, settings.stripe_breaker_reset_seconds))
@@ -9,17 +9,48 @@ class Settings(BaseSettings):
     authjwt_secret_key: str
     access_token_expire_minutes: int
     refresh_token_expire_days: int
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 2
     tax_rate: float
     delivery_fee: float
     smtp_email: str
     smtp_pwd: str
+    smtp_host: str = 'smtp.gmail.com'
+    smtp_port: int = 587
+    smtp_start_tls: bool = True
     order_confirm_contact: str
     store_addr: str
     google_map_api_key: str
+    google_map_api_base: str = 'https://maps.googleapis.com'
+    maps_timeout_seconds: float = 3
+    maps_max_concurrency: int = 20
+    maps_breaker_failures: int = 5
+    maps_breaker_reset_seconds: float = 30
     delivery_range: int
     stripe_api_key: str
+    stripe_api_base: str = 'https://api.stripe.com'
+    stripe_timeout_seconds: float = 10
+    stripe_max_concurrency: int = 20
+    stripe_breaker_failures: int = 5
+    stripe_breaker_reset_seconds: float = 30
     client_hostname: str
     image_path: str
+    image_workers: int = 2
+    image_max_upload_bytes: int = 20 * 1024 * 1024
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    distance_cache_ttl_days: int = 90
+    outbox_batch_size: int = 50
+    outbox_poll_seconds: float = 5
+    outbox_max_attempts: int = 8
+    order_sweep_interval_seconds: float = 60
+    order_sweep_batch_size: int = 500
+    inventory_reservation_minutes: int = 20
+    cart_cache_ttl_seconds: int = 60
+    cart_cache_max_users: int = 10000
 
     class Config:
         env_file = ".env"
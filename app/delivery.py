@@ -0,0 +1,112 @@
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert
+import asyncio
+import datetime
+import logging
+import re
+from . import models
+from .config import settings
+from .database import SessionLocal
+from .utils import get_distance_miles, DistanceLookupError
+
+logger = logging.getLogger(__name__)
+
+# spellings that refer to the same address, reduced to one form before caching
+ADDRESS_ABBREVIATIONS = {
+    'street': 'st', 'avenue': 'ave', 'road': 'rd', 'boulevard': 'blvd', 'drive': 'dr', 'lane': 'ln',
+    'court': 'ct', 'place': 'pl', 'terrace': 'ter', 'parkway': 'pkwy', 'highway': 'hwy', 'circle': 'cir',
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'apartment': 'apt', 'suite': 'ste', 'unit': '#',
+}
+
+def format_address(addr):
+    if addr.address_line_2:
+        return addr.address_line_1 + ' ' + addr.address_line_2 + ', ' + addr.city + ', ' + addr.state + ' ' + addr.zip_code
+    else:
+        return addr.address_line_1 + ', ' + addr.city + ', ' + addr.state + ' ' + addr.zip_code
+
+def normalize_address(customer_addr):
+    words = re.findall(r'[a-z0-9#]+', customer_addr.lower())
+    return ' '.join(ADDRESS_ABBREVIATIONS.get(word, word) for word in words)
+
+def delivery_verdict(distance_miles):
+    if distance_miles is None:
+        return False, 'The address you entered could not be found.'
+    if distance_miles > settings.delivery_range:
+        return False, 'Sorry, the address you entered is out of our delivery range.'
+    return True, ''
+
+async def cached_distance(db: AsyncSession, address):
+    ttl = datetime.timedelta(days=settings.distance_cache_ttl_days)
+    return await db.scalar(select(models.DeliveryDistance)
+                           .where(models.DeliveryDistance.address == address,
+                                  models.DeliveryDistance.checked_at > func.now() - ttl))
+
+# the caller commits
+async def store_distance(db: AsyncSession, address, distance_miles):
+    upsert_stmt = insert(models.DeliveryDistance).values(address=address, distance_miles=distance_miles)
+    upsert_stmt = upsert_stmt.on_conflict_do_update(index_elements=[models.DeliveryDistance.address],
+                                                    set_={'distance_miles': distance_miles, 'checked_at': func.now()})
+    await db.execute(upsert_stmt)
+
+'''
+Check if the given address is within our delivery range
+Distances are cached by normalized address, so repeat addresses don't call the Distance Matrix API again
+The cache is read and written on sessions of its own, which are closed while the API is called:
+no connection is held and no transaction of the caller is touched, call it before opening one
+Returns two values: (a boolean that indicates if the address is within our range, error message)
+'''
+async def check_addr_within_range(customer_addr):
+    address = normalize_address(customer_addr)
+    async with SessionLocal() as db:
+        cached = await cached_distance(db, address)
+    if cached:
+        return delivery_verdict(cached.distance_miles)
+    try:
+        distance_miles = await get_distance_miles(customer_addr)
+    except DistanceLookupError:
+        return False, 'Sorry, something went wrong.'
+    async with SessionLocal() as db:
+        await store_distance(db, address, distance_miles)
+        await db.commit()
+    return delivery_verdict(distance_miles)
+
+'''
+Fill the distance cache with the addresses of past delivery orders and users' saved addresses
+Run with `python -m app.delivery`
+'''
+async def warm_distance_cache():
+    async with SessionLocal() as db:
+        order_addrs = await db.execute(select(models.Order.address_line_1, models.Order.address_line_2,
+                                              models.Order.city, models.Order.state, models.Order.zip_code)
+                                       .where(models.Order.order_type == 'delivery',
+                                              models.Order.address_line_1 != None)
+                                       .distinct())
+        user_addrs = await db.execute(select(models.User.address_line_1, models.User.address_line_2,
+                                             models.User.city, models.User.state, models.User.zip_code)
+                                      .where(models.User.address_line_1 != None)
+                                      .distinct())
+        addresses = {}
+        for addr in [*order_addrs, *user_addrs]:
+            if None in (addr.city, addr.state, addr.zip_code):
+                continue
+            customer_addr = format_address(addr)
+            addresses.setdefault(normalize_address(customer_addr), customer_addr)
+        looked_up = 0
+        for address, customer_addr in addresses.items():
+            if await cached_distance(db, address):
+                continue
+            try:
+                distance_miles = await get_distance_miles(customer_addr)
+            except DistanceLookupError:
+                logger.warning('distance lookup failed for %s', customer_addr)
+                continue
+            await store_distance(db, address, distance_miles)
+            await db.commit()
+            looked_up += 1
+        logger.info('looked up %d of %d known addresses', looked_up, len(addresses))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(warm_distance_cache())
@@ -0,0 +1,135 @@
+from fastapi import Request, Response, status
+from fastapi.responses import FileResponse
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+import multiprocessing
+import asyncio
+import hashlib
+import io
+import os
+import re
+from .config import settings
+
+# versioned image urls never change content, unversioned ones are revalidated with their ETag on every use
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+
+class ImageFile:
+    def __init__(self, path, stat_result, digest):
+        self.path = path
+        self.stat_result = stat_result
+        self.etag = f'"{digest}"'
+        # short content hash used in image urls
+        self.version = digest[:16]
+
+'''
+Validators of the product images on disk, derived without reading the files
+Ingested images carry the hash of their content in their name ({digest}_{variant}.webp);
+any other file is identified by its size and modification time, like static file servers do,
+so building the catalog costs one stat per image however large the photos are.
+'''
+class ImageStore:
+    def __init__(self, image_path):
+        self.image_path = image_path
+
+    def lookup(self, filename):
+        path = os.path.join(self.image_path, filename)
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        if is_variant_filename(filename):
+            digest = filename.removesuffix('.webp')
+        else:
+            digest = hashlib.sha256(f'{filename}:{stat_result.st_mtime_ns}:{stat_result.st_size}'.encode()).hexdigest()
+        return ImageFile(path, stat_result, digest)
+
+    # blocking, run it in a thread
+    def lookup_many(self, filenames):
+        images = {}
+        for key, filename in filenames.items():
+            image = self.lookup(filename)
+            if image is not None:
+                images[key] = image
+        return images
+
+image_store = ImageStore(settings.image_path)
+
+def image_url(product_id, image: ImageFile):
+    return f'/products/image/{product_id}/{image.version}'
+
+def image_response(request: Request, image: ImageFile, cache_control):
+    headers = {'ETag': image.etag, 'Cache-Control': cache_control}
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and (if_none_match.strip() == '*' or image.etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    # the stat result from hashing is passed on, so serving the file doesn't stat it again
+    return FileResponse(image.path, headers=headers, stat_result=image.stat_result)
+
+# variants generated for every uploaded image, by the longest side they are scaled down to
+IMAGE_VARIANTS = {
+    'thumb': 200,
+    'card': 600,
+    'full': 1600,
+}
+WEBP_QUALITY = 80
+
+VARIANT_FILENAME = re.compile(r'[0-9a-f]{64}_(%s)\.webp' % '|'.join(IMAGE_VARIANTS))
+
+class InvalidImage(Exception):
+    pass
+
+def variant_filename(digest, variant):
+    return f'{digest}_{variant}.webp'
+
+def variant_url(filename):
+    return f'/products/images/{filename}'
+
+def is_variant_filename(filename):
+    return VARIANT_FILENAME.fullmatch(filename) is not None
+
+'''
+Store an uploaded image by the sha256 of its content and generate its variants as WebP files,
+named {digest}_{variant}.webp in image_path.
+An image that was uploaded before already has its variants on disk and is not decoded again,
+only their sizes are read back.
+Returns {variant: {'file', 'width', 'height'}}, which is what Product.image_variants holds.
+Runs in the image process pool (ingest_image), so it must stay a picklable module level function.
+'''
+def make_variants(data, image_path):
+    digest = hashlib.sha256(data).hexdigest()
+    paths = {variant: os.path.join(image_path, variant_filename(digest, variant)) for variant in IMAGE_VARIANTS}
+    if all(os.path.exists(path) for path in paths.values()):
+        variants = {}
+        for variant, path in paths.items():
+            # opening only parses the header
+            with Image.open(path) as image:
+                variants[variant] = {'file': variant_filename(digest, variant), 'width': image.width, 'height': image.height}
+        return variants
+
+    try:
+        with Image.open(io.BytesIO(data)) as original:
+            # phone photos are stored sideways with an orientation tag, which the variants would lose
+            image = ImageOps.exif_transpose(original)
+            has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise InvalidImage(str(exc)) from None
+
+    variants = {}
+    for variant, size in IMAGE_VARIANTS.items():
+        resized = image.copy()
+        # keeps the aspect ratio and never scales up
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        # written under a temporary name first, so a concurrent upload of the same image never sees a partial file
+        tmp_path = f'{paths[variant]}.{os.getpid()}.tmp'
+        resized.save(tmp_path, 'WEBP', quality=WEBP_QUALITY, method=4)
+        os.replace(tmp_path, paths[variant])
+        variants[variant] = {'file': variant_filename(digest, variant), 'width': resized.width, 'height': resized.height}
+    return variants
+
+# decoding and encoding images is CPU bound, spawned workers don't inherit the event loop and connection pool of the app
+image_executor = ProcessPoolExecutor(max_workers=settings.image_workers, mp_context=multiprocessing.get_context('spawn'))
+
+async def ingest_image(data):
+    return await asyncio.get_running_loop().run_in_executor(image_executor, make_variants, data, settings.image_path)
@@ -0,0 +1,80 @@
+from sqlalchemy import select, update, delete, func, literal
+from sqlalchemy.dialects.postgresql import insert
+import datetime
+from . import models
+from .config import settings
+
+# units of every product in an order, an order may list the same product more than once
+def order_quantities(order_id):
+    return select(models.OrderItem.product_id, func.sum(models.OrderItem.quantity).label('quantity')) \
+               .where(models.OrderItem.order_id == order_id) \
+               .group_by(models.OrderItem.product_id).subquery()
+
+'''
+Lock the products with ids in `product_ids` (a list or a subquery), always in id order
+Every statement that changes a product's inventory or reserved units runs this first, so that concurrent checkouts,
+completions and the sweeper take their row locks in the same order and can't deadlock on products they share
+'''
+async def lock_products(db, product_ids):
+    result = await db.execute(select(models.Product.id).where(models.Product.id.in_(product_ids))
+                              .order_by(models.Product.id).with_for_update())
+    return result.scalars().all()
+
+'''
+Reserve the units of every product in the order until it is paid for, all or nothing
+Every product is reserved with a conditional update that only matches while enough units are unreserved,
+so concurrent checkouts of a hot product queue up on its row and can never oversell it.
+The order's products are locked first, see lock_products.
+Returns False if any product is short, the caller must then roll back the partial reservation
+'''
+async def reserve_order_inventory(db, order_id) -> bool:
+    quantities = order_quantities(order_id)
+    product_ids = await lock_products(db, select(quantities.c.product_id))
+    reserved = update(models.Product).where(models.Product.id == quantities.c.product_id,
+                                            models.Product.inventory - models.Product.reserved >= quantities.c.quantity) \
+                                     .values(reserved=models.Product.reserved + quantities.c.quantity) \
+                                     .returning(models.Product.id, quantities.c.quantity) \
+                                     .cte('reserved')
+    expires_at = func.now() + datetime.timedelta(minutes=settings.inventory_reservation_minutes)
+    result = await db.execute(insert(models.InventoryReservation)
+                              .from_select(['order_id', 'product_id', 'quantity', 'expires_at'],
+                                           select(literal(order_id), reserved.c.id, reserved.c.quantity, expires_at))
+                              .returning(models.InventoryReservation.product_id))
+    return len(result.all()) == len(product_ids)
+
+# keep the order's reservations until it is completed or canceled
+async def hold_reservations(db, order_id):
+    await db.execute(update(models.InventoryReservation).where(models.InventoryReservation.order_id == order_id)
+                     .values(expires_at=None).execution_options(synchronize_session=False))
+
+'''
+Delete the reservations matching `where` and give their units back, in one statement
+after locking their products, see lock_products
+Works with a session as well as a plain connection
+'''
+async def release_reservations(db, *where):
+    await lock_products(db, select(models.InventoryReservation.product_id).where(*where))
+    released = delete(models.InventoryReservation).where(*where) \
+                   .returning(models.InventoryReservation.product_id, models.InventoryReservation.quantity) \
+                   .cte('released')
+    totals = select(released.c.product_id, func.sum(released.c.quantity).label('quantity')) \
+                 .group_by(released.c.product_id).subquery()
+    await db.execute(update(models.Product).where(models.Product.id == totals.c.product_id)
+                     .values(reserved=models.Product.reserved - totals.c.quantity)
+                     .execution_options(synchronize_session=False))
+
+'''
+Take a completed order's units out of inventory and drop its reservations
+Orders whose reservation expired before payment have nothing to release and are only taken out of inventory
+Returns the ids of the products whose inventory changed
+'''
+async def commit_order_inventory(db, order_id):
+    quantities = order_quantities(order_id)
+    # the order's products include those of its reservations
+    await lock_products(db, select(quantities.c.product_id))
+    await release_reservations(db, models.InventoryReservation.order_id == order_id)
+    result = await db.scalars(update(models.Product).where(models.Product.id == quantities.c.product_id)
+                              .values(inventory=models.Product.inventory - quantities.c.quantity)
+                              .returning(models.Product.id)
+                              .execution_options(synchronize_session=False))
+    return result.all()
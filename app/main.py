@@ -1,24 +1,47 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi_jwt_auth import AuthJWT
 from fastapi_jwt_auth.exceptions import AuthJWTException
 from pydantic import BaseModel
-from . import models
 from .database import engine
-from .routers import product, user, cart, order
+from .routers import product, user, cart, order, admin
 from .config import settings
+from .cache import invalidation_listener
+from .clients import maps_client, stripe_client
+from .outbox import outbox_worker
+from .sweeper import order_sweeper
+from .utils import password_executor
+from .images import image_executor
 import logging
 from fastapi import FastAPI, Request, status
 from fastapi.exceptions import RequestValidationError
 
-models.Base.metadata.create_all(bind=engine)
-
-app = FastAPI()
+# orjson encodes large lists several times faster than the json module
+app = FastAPI(default_response_class=ORJSONResponse)
 app.include_router(product.router)
 app.include_router(user.router)
 app.include_router(cart.router)
 app.include_router(order.router)
+app.include_router(admin.router)
+
+# the schema is managed by alembic, run `alembic upgrade head` before starting the app
+@app.on_event("startup")
+async def start_background_tasks():
+    invalidation_listener.start()
+    outbox_worker.start()
+    order_sweeper.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await invalidation_listener.stop()
+    await outbox_worker.stop()
+    await order_sweeper.stop()
+    await maps_client.aclose()
+    await stripe_client.aclose()
+    await engine.dispose()
+    password_executor.shutdown(wait=False)
+    image_executor.shutdown(wait=False)
 
 app.add_middleware(
     CORSMiddleware,
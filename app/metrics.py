@@ -0,0 +1,51 @@
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+import bisect
+import time
+
+class Histogram:
+    def __init__(self, bounds):
+        # upper bounds of the buckets, the last bucket catches everything above them
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        buckets = {f'le_{bound}': count for bound, count in zip(self.bounds, self.counts)}
+        buckets['inf'] = self.counts[-1]
+        return {'count': self.count, 'sum': round(self.sum, 3), 'buckets': buckets}
+
+class PoolMetrics:
+    def __init__(self):
+        # time spent waiting for a pooled connection, in milliseconds
+        self.checkout_wait_ms = Histogram([1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000])
+        # checkouts that had to open a connection beyond pool_size
+        self.overflow_events = 0
+        # checkouts that gave up after pool_timeout
+        self.checkout_timeouts = 0
+
+pool_metrics = PoolMetrics()
+
+'''
+Connection pool that records how long each checkout waited and whether it overflowed or timed out.
+'''
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        overflow = self._overflow
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.checkout_timeouts += 1
+            raise
+        finally:
+            pool_metrics.checkout_wait_ms.observe((time.perf_counter() - start) * 1000)
+        if self._overflow > overflow and self._overflow > 0:
+            pool_metrics.overflow_events += 1
+        return connection
@@ -1,6 +1,7 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, UniqueConstraint, Index
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -15,9 +16,13 @@ class Product(Base):
     description = Column(String, nullable=True)
     popularity = Column(Integer, nullable=False, server_default='0')
     inventory = Column(Integer, nullable=False, server_default='0')
+    # units held by inventory_reservations, only inventory - reserved can be ordered
+    reserved = Column(Integer, nullable=False, server_default='0')
     cost = Column(Float, nullable=False, server_default='0')
     price = Column(Float, nullable=False)
     image = Column(String, nullable=True)
+    # {variant: {file, width, height}} of an ingested image, see images.make_variants
+    image_variants = Column(JSONB, nullable=True)
     created_at = Column(TIMESTAMP, nullable=False, server_default=text('now()'))
 
 class User(Base):
@@ -39,9 +44,12 @@ class User(Base):
     is_admin = Column(Boolean, nullable=False, server_default="False")
     is_verified = Column(Boolean, nullable=False, server_default="False")
     orders = relationship("Order", backref="user")
+    # login looks users up by email, which also makes it unique
+    __table_args__ = (Index('ix_users_email', email, unique=True),)
 
 class CartItem(Base):
     __tablename__ = "carts"
+    __table_args__ = (UniqueConstraint('user_id', 'product_id'),)
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
@@ -57,7 +65,7 @@ class Order(Base):
     subtotal = Column(Float, nullable=False)
     total = Column(Float, nullable=False)
     order_type = Column(String, nullable=False) # delivery or pick up
-    status = Column(String, nullable=False) # created, placed, confirmed, completed
+    status = Column(String, nullable=False) # created, placed, confirmed, accepted, completed, error or canceled, see order_status.py
     # customer Info fields
     first_name = Column(String, nullable=False)
     last_name = Column(String, nullable=False)
@@ -76,14 +84,61 @@ class Order(Base):
     cancel_reason = Column(String, nullable=True)
 
     reference_id = Column(String, nullable=True)
+    # Idempotency-Key header of the checkout request that created the order
+    idempotency_key = Column(String, nullable=True, unique=True)
+    # sha256 of that request's body, a retry with the same key must send the same order
+    idempotency_fingerprint = Column(String, nullable=True)
     created_at = Column(TIMESTAMP, nullable=False, server_default=text('now()'))
-    items = relationship('OrderItem', backref='order')
+    # never lazy loaded, order routes eager load items and their products with selectinload
+    items = relationship('OrderItem', backref='order', lazy='raise')
+    __table_args__ = (
+        # a customer's order history, newest first
+        Index('ix_orders_user_history', user_id, id.desc(),
+              postgresql_where=status.in_(['confirmed', 'accepted', 'completed', 'canceled'])),
+        # unfinished orders the sweeper deletes once they are past their deadline
+        Index('ix_orders_unfinished_created_at', status, created_at,
+              postgresql_where=status.in_(['created', 'placed', 'error'])),
+    )
 
 class OrderItem(Base):
     __tablename__ = "order_items"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    order_id = Column(Integer, ForeignKey('orders.id', ondelete='CASCADE'), nullable=False)
+    order_id = Column(Integer, ForeignKey('orders.id', ondelete='CASCADE'), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    product = relationship("Product", lazy='raise')
+    quantity = Column(Integer, nullable=False)
+    created_at = Column(TIMESTAMP, nullable=False, server_default=text('now()'))
+
+class InventoryReservation(Base):
+    __tablename__ = "inventory_reservations"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    order_id = Column(Integer, ForeignKey('orders.id', ondelete='CASCADE'), nullable=False, index=True)
     product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
-    product = relationship("Product")
     quantity = Column(Integer, nullable=False)
-    created_at = Column(TIMESTAMP, nullable=False, server_default=text('now()'))
\ No newline at end of file
+    # null once the order is paid for, the units are then held until the order is completed or canceled
+    expires_at = Column(TIMESTAMP, nullable=True)
+    created_at = Column(TIMESTAMP, nullable=False, server_default=text('now()'))
+    __table_args__ = (Index('ix_inventory_reservations_expires_at', expires_at, postgresql_where=(expires_at != None)),)
+
+class DeliveryDistance(Base):
+    __tablename__ = "delivery_distances"
+    # normalized customer address
+    address = Column(String, primary_key=True)
+    # driving distance from the store, null if the address could not be found
+    distance_miles = Column(Float, nullable=True)
+    checked_at = Column(TIMESTAMP, nullable=False, server_default=text('now()'))
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox_messages"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False) # sms or verification_email
+    recipient = Column(String, nullable=False)
+    # empty for kinds that are rendered from a prebuilt template
+    body = Column(String, nullable=False, server_default='')
+    status = Column(String, nullable=False, server_default='pending') # pending, sent, failed
+    attempts = Column(Integer, nullable=False, server_default='0')
+    next_attempt_at = Column(TIMESTAMP, nullable=False, server_default=text('now()'))
+    last_error = Column(String, nullable=True)
+    sent_at = Column(TIMESTAMP, nullable=True)
+    created_at = Column(TIMESTAMP, nullable=False, server_default=text('now()'))
+    __table_args__ = (Index('ix_outbox_messages_pending', next_attempt_at, postgresql_where=(status == 'pending')),)
\ No newline at end of file
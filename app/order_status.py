@@ -0,0 +1,42 @@
+from fastapi import status, HTTPException
+from sqlalchemy import select, update
+from . import models
+
+'''
+Order state machine: new status -> statuses an order can move to it from
+created -> placed -> confirmed -> accepted -> completed, with error for checkouts
+that failed before payment and canceled for orders the store won't fulfill.
+A completed order has taken its units out of inventory and can't be canceled any more.
+'''
+ORDER_TRANSITIONS = {
+    'placed': {'created'},
+    'error': {'created', 'placed'},
+    'confirmed': {'placed'},
+    'accepted': {'confirmed'},
+    'completed': {'confirmed', 'accepted'},
+    'canceled': {'created', 'placed', 'confirmed', 'accepted'},
+}
+
+'''
+Compare-and-set of an order's status: UPDATE ... WHERE status IN (statuses allowed to move to new_status)
+Callers add .returning(...) and run it as the transition's only statement. A concurrent transition of the same
+order waits on the row lock and is then checked against the committed status, so of two racing requests
+(a double-click, or a webhook and the client reporting the same payment) exactly one updates the order.
+When no row comes back, order_status() tells why.
+'''
+def order_transition(order_id, new_status, **values):
+    return update(models.Order).where(models.Order.id == order_id,
+                                      models.Order.status.in_(ORDER_TRANSITIONS[new_status])) \
+                               .values(status=new_status, **values)
+
+# status of an order whose transition didn't match, only queried on that path
+async def order_status(db, order_id):
+    current = await db.scalar(select(models.Order.status).where(models.Order.id == order_id))
+    if current == None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail="order does not exist")
+    return current
+
+def transition_conflict(order_id, current, new_status):
+    return HTTPException(status_code=status.HTTP_409_CONFLICT,
+                         detail=f"Order #{order_id} is {current} and can not be {new_status}")
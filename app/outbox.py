@@ -0,0 +1,146 @@
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+import aiosmtplib
+import asyncio
+import datetime
+import logging
+from . import models
+from .config import settings
+from .database import SessionLocal
+from .cache import invalidation_listener, notify_change
+from .utils import build_verification_email
+
+OUTBOX_CHANNEL = 'outbox_pending'
+
+logger = logging.getLogger(__name__)
+
+'''
+One SMTP connection per worker, opened on first use, kept open between messages
+and reopened when the server has dropped it.
+'''
+class Mailer:
+    def __init__(self):
+        self._smtp = None
+
+    async def _connect(self):
+        self._smtp = aiosmtplib.SMTP(hostname=settings.smtp_host,
+                                     port=settings.smtp_port,
+                                     start_tls=settings.smtp_start_tls,
+                                     username=settings.smtp_email,
+                                     password=settings.smtp_pwd)
+        await self._smtp.connect()
+
+    async def _send(self, send):
+        if self._smtp is None or not self._smtp.is_connected:
+            await self._connect()
+        try:
+            await send(self._smtp)
+        except aiosmtplib.SMTPServerDisconnected:
+            # the server closed our idle connection, try once more on a new one
+            await self._connect()
+            await send(self._smtp)
+
+    async def sendmail(self, recipient, message):
+        await self._send(lambda smtp: smtp.sendmail(settings.smtp_email, recipient, message))
+
+    async def send_message(self, message):
+        await self._send(lambda smtp: smtp.send_message(message))
+
+    async def close(self):
+        if self._smtp is not None and self._smtp.is_connected:
+            try:
+                await self._smtp.quit()
+            except aiosmtplib.SMTPException:
+                self._smtp.close()
+        self._smtp = None
+
+'''
+Queue a message in the outbox as part of the caller's transaction.
+It is only delivered if that transaction commits.
+'''
+async def enqueue_message(db: AsyncSession, kind: str, recipient: str, body: str = ''):
+    db.add(models.OutboxMessage(kind=kind, recipient=recipient, body=body))
+    await notify_change(db, OUTBOX_CHANNEL)
+
+def retry_delay(attempts):
+    return datetime.timedelta(seconds=min(5 * 2 ** attempts, 3600))
+
+'''
+Background task that delivers pending outbox messages in batches over one persistent SMTP connection.
+Woken up by NOTIFY when a message is queued, and polls every outbox_poll_seconds for retries.
+Rows are claimed with SKIP LOCKED, so every worker process can run one of these without sending twice.
+'''
+class OutboxWorker:
+    def __init__(self, mailer):
+        self.mailer = mailer
+        self._wakeup = None
+        self._task = None
+
+    def wake(self, payload=None):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.mailer.close()
+
+    async def _run(self):
+        while True:
+            try:
+                delivered = await self.deliver_batch()
+            except Exception:
+                logger.exception('outbox delivery failed')
+                delivered = 0
+            if delivered < settings.outbox_batch_size:
+                # caught up, sleep until a new message is queued or a retry may be due
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.outbox_poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def deliver_batch(self):
+        async with SessionLocal() as db:
+            messages = (await db.scalars(select(models.OutboxMessage)
+                                         .where(models.OutboxMessage.status == 'pending',
+                                                models.OutboxMessage.next_attempt_at <= func.now())
+                                         .order_by(models.OutboxMessage.id)
+                                         .limit(settings.outbox_batch_size)
+                                         .with_for_update(skip_locked=True))).all()
+            for message in messages:
+                try:
+                    await self.send(message)
+                except (aiosmtplib.SMTPException, OSError, ValueError) as e:
+                    message.attempts += 1
+                    message.last_error = str(e)
+                    if message.attempts >= settings.outbox_max_attempts:
+                        logger.error('giving up on outbox message %d: %s', message.id, e)
+                        message.status = 'failed'
+                    else:
+                        message.next_attempt_at = func.now() + retry_delay(message.attempts)
+                else:
+                    message.status = 'sent'
+                    message.sent_at = func.now()
+            await db.commit()
+            return len(messages)
+
+    async def send(self, message):
+        if message.kind == 'sms':
+            # texts are delivered through the carrier's email gateway
+            await self.mailer.sendmail(message.recipient, message.body)
+        elif message.kind == 'verification_email':
+            await self.mailer.send_message(build_verification_email(message.recipient))
+        else:
+            raise ValueError(f'unknown outbox message kind {message.kind}')
+
+outbox_worker = OutboxWorker(Mailer())
+invalidation_listener.register(OUTBOX_CHANNEL, outbox_worker.wake)
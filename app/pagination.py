@@ -0,0 +1,71 @@
+from fastapi import status, HTTPException
+from sqlalchemy import select
+import base64
+import binascii
+import bisect
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+'''
+Cursors are opaque to clients; they wrap the integer id of the last row of the previous page.
+'''
+def encode_cursor(last_id: int):
+    return base64.urlsafe_b64encode(json.dumps(last_id).encode()).decode()
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        last_id = None
+    if type(last_id) is not int:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return last_id
+
+'''
+Keyset pagination over a unique, indexed column.
+Returns one page (at most `limit` rows after the row the cursor points at) and the cursor of the next page,
+so the cost depends on the page size rather than on how many rows come before it.
+'''
+async def paginate(db, statement, key_column, cursor, limit, descending=False):
+    if cursor:
+        last_key = decode_cursor(cursor)
+        statement = statement.where(key_column < last_key if descending else key_column > last_key)
+    statement = statement.order_by(key_column.desc() if descending else key_column).limit(limit + 1)
+    rows = (await db.scalars(statement)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], key_column.key))
+    return {'items': rows, 'next_cursor': next_cursor}
+
+'''
+paginate() for large list responses that skip the ORM and response_model validation.
+Only the columns of `model` named by the fields of `schema` are selected, and rows come back
+as plain dicts, ready to be sent as they are with ORJSONResponse.
+The endpoint still declares the schema as its response_model, for the docs.
+'''
+async def paginate_rows(db, schema, model, key_column, cursor, limit, descending=False, where=()):
+    statement = select(*(getattr(model, name) for name in schema.__fields__)).where(*where)
+    if cursor:
+        last_key = decode_cursor(cursor)
+        statement = statement.where(key_column < last_key if descending else key_column > last_key)
+    statement = statement.order_by(key_column.desc() if descending else key_column).limit(limit + 1)
+    result = await db.execute(statement)
+    keys = list(result.keys())
+    rows = [dict(zip(keys, row)) for row in result]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][key_column.key])
+    return {'items': rows, 'next_cursor': next_cursor}
+
+'''
+Same as paginate(), for rows already in memory and sorted by their (unique, ascending) `keys`.
+'''
+def paginate_sorted(rows, keys, cursor, limit):
+    start = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+    page = rows[start:start + limit]
+    next_cursor = encode_cursor(keys[start + limit - 1]) if start + limit < len(rows) else None
+    return {'items': page, 'next_cursor': next_cursor}
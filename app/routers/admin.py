@@ -0,0 +1,43 @@
+from fastapi import Depends, APIRouter
+import os
+from ..database import engine
+from ..auth import require_admin
+from ..config import settings
+from ..metrics import pool_metrics
+from ..sweeper import order_sweeper
+
+router = APIRouter(prefix='/admin')
+
+'''
+Connection pool state of the worker that serves the request.
+Every worker has its own pool, so a deployment can open up to
+(number of workers) * max_connections_per_worker connections to Postgres.
+'''
+@router.get('/pool')
+async def get_pool_metrics(admin_id: int = Depends(require_admin)):
+    pool = engine.pool
+    return {
+        'worker_pid': os.getpid(),
+        'pool_size': pool.size(),
+        'max_overflow': settings.db_max_overflow,
+        'max_connections_per_worker': pool.size() + settings.db_max_overflow,
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': max(pool.overflow(), 0),
+        'overflow_events': pool_metrics.overflow_events,
+        'checkout_timeouts': pool_metrics.checkout_timeouts,
+        'checkout_wait_ms': pool_metrics.checkout_wait_ms.snapshot(),
+    }
+
+'''
+Expired order sweeps run by the worker that serves the request.
+Only one worker sweeps at a time, so the totals of the other workers only cover the sweeps they led.
+'''
+@router.get('/sweeper')
+async def get_sweeper_metrics(admin_id: int = Depends(require_admin)):
+    return {
+        'worker_pid': os.getpid(),
+        'removed_total': order_sweeper.removed_total,
+        'last_removed': order_sweeper.last_removed,
+        'last_swept_at': order_sweeper.last_swept_at,
+    }
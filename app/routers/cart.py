@@ -1,61 +1,90 @@
 from fastapi import status, HTTPException, Depends, APIRouter
-from typing import List
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert
 from fastapi_jwt_auth import AuthJWT
 from ..database import get_db
 from .. import models, schemas
+from ..config import settings
+from ..cache import cart_cache, cart_changed, notify_change, CART_CHANNEL
 
 router = APIRouter(prefix='/cart')
 
 @router.get("", response_model=List[schemas.CartItem])
-def get_cart(Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
+async def get_cart(Authorize: AuthJWT = Depends(), db: AsyncSession = Depends(get_db)):
     Authorize.jwt_required()
     user_id = Authorize.get_jwt_subject()
-    cart_items = db.query(models.CartItem).join(models.Product, models.CartItem.user_id == user_id)
-    response = []
-    for cart_item in cart_items:
-        response.append(schemas.CartItem(id=cart_item.product_id, 
-                                         name=cart_item.product.name,
-                                         price=cart_item.product.price,
-                                         inventory=cart_item.product.inventory,
-                                         size=cart_item.product.size,
-                                         category=cart_item.product.category,
-                                         quantity=cart_item.quantity,
-                                         synced=True))
-    return response
+    cached_items = cart_cache.get(user_id)
+    if cached_items is not None:
+        return cached_items
+    generation = cart_cache.generation
+    rows = await db.execute(select(models.Product.id,
+                                   models.Product.name,
+                                   models.Product.price,
+                                   models.Product.inventory,
+                                   models.Product.size,
+                                   models.Product.category,
+                                   models.Product.subcategory,
+                                   models.Product.description,
+                                   models.CartItem.quantity)
+                            .join(models.Product, models.Product.id == models.CartItem.product_id)
+                            .where(models.CartItem.user_id == user_id)
+                            .order_by(models.CartItem.id))
+    cart_items = [schemas.CartItem(**row._mapping, synced=True) for row in rows]
+    cart_cache.put(user_id, cart_items, generation)
+    return cart_items
 
 @router.put("", response_model=List[schemas.CartItem])
-def update_cart(cart: schemas.UserCart, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
+async def update_cart(cart: schemas.UserCart, Authorize: AuthJWT = Depends(), db: AsyncSession = Depends(get_db)):
     Authorize.jwt_required()
     user_id = Authorize.get_jwt_subject()
     if not cart.items:
         # empty cart
-        update_query = db.query(models.CartItem).filter(models.CartItem.user_id == user_id)
-        update_query.delete(synchronize_session=False)
-    for item in cart.items:
-        if not item.synced:
-            # user modified cart item in front end, update in db
-            update_query = db.query(models.CartItem).filter(models.CartItem.user_id == user_id, models.CartItem.product_id == item.id)
-            old_item = update_query.first()
-            item.synced = True
-            if old_item == None:
-                # new item
-                new_item = models.CartItem(user_id=user_id,
-                                           product_id=item.id,
-                                           quantity=item.quantity)
-                db.add(new_item)
-            else:
-                if item.quantity == 0:
-                    update_query.delete(synchronize_session=False)
-                    cart.items.remove(item)
-                else:
-                    update_query.update({'quantity': item.quantity}, synchronize_session=False)
-    db.commit()
-    return cart.items
+        await db.execute(delete(models.CartItem).where(models.CartItem.user_id == user_id))
+    # items the user modified in front end, by product id (the last change of a product wins)
+    changes = {item.id: item.quantity for item in cart.items if not item.synced}
+    upserts = [{'user_id': user_id, 'product_id': product_id, 'quantity': quantity}
+               for product_id, quantity in changes.items() if quantity > 0]
+    removed_ids = [product_id for product_id, quantity in changes.items() if quantity <= 0]
+    if upserts:
+        upsert_stmt = insert(models.CartItem).values(upserts)
+        upsert_stmt = upsert_stmt.on_conflict_do_update(index_elements=[models.CartItem.user_id, models.CartItem.product_id],
+                                                        set_={'quantity': upsert_stmt.excluded.quantity})
+        await db.execute(upsert_stmt)
+    if removed_ids:
+        await db.execute(delete(models.CartItem).where(models.CartItem.user_id == user_id, models.CartItem.product_id.in_(removed_ids)))
+    await notify_change(db, CART_CHANNEL, str(user_id))
+    await db.commit()
+    cart_changed(user_id)
+    return [item.copy(update={'synced': True}) for item in cart.items if item.synced or changes[item.id] > 0]
 
-def calculate_cart_subtotal(cart_items:List[schemas.CartItem], db: Session = Depends(get_db)):
-    subtotal = 0
+'''
+Price a cart with a single lookup of all its products.
+The quote keeps the price and inventory of every product it used, so checkout doesn't need to fetch them again.
+'''
+async def quote_cart(cart_items: List[schemas.CartItem], order_type: str, tip: Optional[float], db: AsyncSession) -> schemas.CartQuote:
+    product_ids = {item.id for item in cart_items}
+    rows = await db.execute(select(models.Product.id, models.Product.price, models.Product.inventory).where(models.Product.id.in_(product_ids)))
+    products = {row.id: schemas.QuotedProduct(price=row.price, inventory=row.inventory) for row in rows}
+    missing_ids = product_ids - products.keys()
+    if missing_ids:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"product with id: {min(missing_ids)} does not exist")
+    subtotal = sum(products[item.id].price * item.quantity for item in cart_items)
+    if order_type == 'pick up':
+        delivery_fee = 0
+        tip = 0
+    else:
+        delivery_fee = settings.delivery_fee
+        tip = tip or 0
+    tax = (subtotal + delivery_fee) * settings.tax_rate
+    total = round(subtotal + delivery_fee + tax + tip, 2)
+    return schemas.CartQuote(subtotal=subtotal, total=total, products=products)
+
+# ids of the products a cart asks for more units of than the quote found in inventory
+def out_of_stock(cart_items: List[schemas.CartItem], quote: schemas.CartQuote):
+    quantities = {}
     for item in cart_items:
-        item_price = db.query(models.Product).filter(models.Product.id == item.id).first().price
-        subtotal += item_price * item.quantity
-    return subtotal
\ No newline at end of file
+        quantities[item.id] = quantities.get(item.id, 0) + item.quantity
+    return [product_id for product_id, quantity in quantities.items() if quantity > quote.products[product_id].inventory]
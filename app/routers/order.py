@@ -1,255 +1,281 @@
-from fastapi import status, HTTPException, Depends, APIRouter
-from typing import List
-from sqlalchemy.orm import Session
+from fastapi import status, HTTPException, Depends, APIRouter, Query, Header
+from fastapi.responses import ORJSONResponse
+from typing import Optional
+from sqlalchemy import select, func, literal, cast, String
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import insert
 from fastapi_jwt_auth import AuthJWT
 import datetime
+import hashlib
 from ..database import get_db
+from ..auth import require_admin
 from .. import models, schemas
 from ..config import settings
-from ..utils import send_txt_message, check_addr_within_range
-from .cart import calculate_cart_subtotal
-import stripe
+from ..delivery import check_addr_within_range, format_address
+from ..outbox import enqueue_message
+from ..order_status import order_transition, order_status, transition_conflict
+from ..inventory import reserve_order_inventory, hold_reservations, release_reservations, commit_order_inventory
+from ..utils import create_payment_intent, PaymentError
+from ..clients import UpstreamUnavailable
+from ..cache import catalog_changed, notify_change, CATALOG_CHANNEL
+from ..pagination import paginate_rows, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from .cart import quote_cart, out_of_stock
 
 router = APIRouter(prefix='/order')
 
-stripe.api_key = settings.stripe_api_key
+# OrderDetailResponse serializes every item and its product, load them up front
+ORDER_DETAIL_LOAD = selectinload(models.Order.items).selectinload(models.OrderItem.product)
 
+'''
+Create the order and a Stripe PaymentIntent for it
+Clients may send an Idempotency-Key header: a retried checkout with the same key gets the order
+and payment intent of the first attempt instead of creating new ones.
+A key only finds an order created by the same user (or guest) with the same request body, see find_order_by_idempotency_key
+'''
 @router.post('/create-payment-intent')
-def create_payment(order: schemas.OrderCreate, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    clean_expired_orders(db)
-    # calculate total
-    subtotal = calculate_cart_subtotal(order.items, db)
-    if order.order_type == 'pick up':
-        total = subtotal * (1 + settings.tax_rate)
-    else:
-        total = (subtotal + settings.delivery_fee) * (1 + settings.tax_rate) + order.tip
-    total = round(total, 2)
-    # add new order to the database
+async def create_payment(order: schemas.OrderCreate, idempotency_key: Optional[str] = Header(None, max_length=255),
+                         Authorize: AuthJWT = Depends(), db: AsyncSession = Depends(get_db)):
     Authorize.jwt_optional()
     user_id = Authorize.get_jwt_subject()
-
-    if user_id:
-        new_order = models.Order(user_id=user_id, 
-                                 subtotal=subtotal,
-                                 total=total, 
-                                 order_type=order.order_type,
-                                 first_name=order.first_name,
-                                 last_name=order.last_name,
-                                 email=order.email,
-                                 phone=order.phone,
-                                 address_line_1=order.address_line_1,
-                                 address_line_2=order.address_line_2,
-                                 city=order.city,
-                                 state=order.state,
-                                 zip_code=order.zip_code,
-                                 schedule=order.schedule,
-                                 tip=round(order.tip, 2),
-                                 status='created')
-        db.add(new_order)
-    else:
-        new_order = models.Order(subtotal=subtotal, 
-                                 total=total,
-                                 order_type=order.order_type, 
-                                 first_name=order.first_name,
-                                 last_name=order.last_name,
-                                 email=order.email,
-                                 phone=order.phone,
-                                 address_line_1=order.address_line_1,
-                                 address_line_2=order.address_line_2,
-                                 city=order.city,
-                                 state=order.state,
-                                 zip_code=order.zip_code,
-                                 schedule=order.schedule,
-                                 tip=round(order.tip, 2),
-                                 status='created')
-        db.add(new_order)
-    db.commit()
-    customer_reference = datetime.datetime.today().strftime('%m%d%Y') + str(new_order.id)
-    update_query = db.query(models.Order).filter(models.Order.id == new_order.id)
-    update_query.update({'reference_id': customer_reference})
-    db.commit()
-
-    for item in order.items:
-        new_order_item = models.OrderItem(order_id=new_order.id, product_id=item.id, quantity=item.quantity)
-        db.add(new_order_item)
-    db.commit()
+    fingerprint = request_fingerprint(order) if idempotency_key else None
+    created_order = await find_order_by_idempotency_key(db, idempotency_key, user_id, fingerprint)
+    if created_order == None:
+        # calculate total
+        quote = await quote_cart(order.items, order.order_type, order.tip, db)
+        # turned away before an order is created, the units are only reserved once it is placed
+        if out_of_stock(order.items, quote):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="Sorry, some items in your order are out of stock.")
+        # add new order and its items to the database in one transaction
+        created_order = await insert_order(db, {'user_id': user_id,
+                                                'subtotal': quote.subtotal,
+                                                'total': quote.total,
+                                                'order_type': order.order_type,
+                                                'first_name': order.first_name,
+                                                'last_name': order.last_name,
+                                                'email': order.email,
+                                                'phone': order.phone,
+                                                'address_line_1': order.address_line_1,
+                                                'address_line_2': order.address_line_2,
+                                                'city': order.city,
+                                                'state': order.state,
+                                                'zip_code': order.zip_code,
+                                                'schedule': order.schedule,
+                                                'tip': round(order.tip, 2),
+                                                'status': 'created',
+                                                'idempotency_key': idempotency_key,
+                                                'idempotency_fingerprint': fingerprint})
+        if created_order == None:
+            # a concurrent request with the same key created the order first
+            created_order = await find_order_by_idempotency_key(db, idempotency_key, user_id, fingerprint)
+        elif order.items:
+            await db.execute(insert(models.OrderItem),
+                             [{'order_id': created_order.id, 'product_id': item.id, 'quantity': item.quantity} for item in order.items])
+    # ends the transaction, which hands the connection back to the pool before Stripe is called
+    await db.commit()
 
     try:
-        # Create a PaymentIntent with the order amount and currency
-        intent = stripe.PaymentIntent.create(
-            amount=int(total * 100),
-            currency='usd',
-            automatic_payment_methods={
-                'enabled': True,
-            },
-            receipt_email=order.email,
-            description=f"Thank you for your order at Bargain Liquor. Your order reference is #{customer_reference}",
+        # the key is derived from the order, so Stripe returns the same intent however often the order is retried,
+        # as long as the parameters are the same: they all come from the stored order, not from this request
+        client_secret = await create_payment_intent(
+            amount=round(created_order.total * 100),
+            receipt_email=created_order.email,
+            description=f"Thank you for your order at Bargain Liquor. Your order reference is #{created_order.reference_id}",
+            idempotency_key=f'order-{created_order.id}-payment-intent',
         )
-        return {
-            'clientSecret': intent['client_secret'], 'orderId': new_order.id, 'total': total
-        }
-    except Exception as e:
+    except PaymentError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail=str(e))
+    except UpstreamUnavailable:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Payment is temporarily unavailable, please try again.")
+    return {
+        'clientSecret': client_secret, 'orderId': created_order.id, 'total': created_order.total
+    }
+
+# identifies a checkout request by its body, which a retry sends unchanged
+def request_fingerprint(order: schemas.OrderCreate):
+    return hashlib.sha256(order.json().encode()).hexdigest()
 
-''' 
+'''
+The order created by an earlier request with the same Idempotency-Key, or None
+The key must have been sent by the same user (or a guest both times) with the same request body,
+otherwise the request is rejected: the order, its payment intent and its total belong to that earlier request
+'''
+async def find_order_by_idempotency_key(db: AsyncSession, idempotency_key: Optional[str], user_id, fingerprint):
+    if not idempotency_key:
+        return None
+    result = await db.execute(select(models.Order.id, models.Order.reference_id, models.Order.total, models.Order.email,
+                                     models.Order.user_id, models.Order.idempotency_fingerprint)
+                              .where(models.Order.idempotency_key == idempotency_key))
+    created_order = result.first()
+    if created_order != None and (created_order.user_id != user_id or created_order.idempotency_fingerprint != fingerprint):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Idempotency-Key was already used for a different request")
+    return created_order
+
+'''
+Insert an order and generate its customer reference (date + order id) in the same statement:
+the id is drawn from the orders sequence in a subquery, so both columns are known on insert
+Returns the new order's (id, reference_id, total, email), or None if an order with the same idempotency key exists
+'''
+async def insert_order(db: AsyncSession, values: dict):
+    order_columns = models.Order.__table__.c
+    new_id = select(func.nextval(func.pg_get_serial_sequence('orders', 'id')).label('id')).subquery()
+    reference_prefix = datetime.datetime.today().strftime('%m%d%Y')
+    new_order = select(new_id.c.id,
+                       literal(reference_prefix) + cast(new_id.c.id, String),
+                       *(literal(value, order_columns[name].type) for name, value in values.items()))
+    result = await db.execute(insert(models.Order).from_select(['id', 'reference_id', *values], new_order)
+                              .on_conflict_do_nothing(index_elements=[models.Order.idempotency_key])
+                              .returning(models.Order.id, models.Order.reference_id, models.Order.total, models.Order.email))
+    return result.first()
+
+'''
 Check if order is valid before payment
-An order (with order.id = order_id) is considered valid if 
-1. The order is present in the database
-2. order.status is not 'error'
-3. If the order is a delivery order, customer's address must be in the delivery rang
+An order (with order.id = order_id) is considered valid if
+1. The order is present in the database and was just created (not placed or failed already)
+2. If the order is a delivery order, customer's address must be in the delivery rang
+3. Every item is in stock, the units are then reserved until payment or inventory_reservation_minutes
+The address is checked before anything is written, with no transaction open, so neither a row lock nor
+a pooled connection is held while the Distance Matrix API is called. The move to placed and the reservation
+are then one transaction: a repeated request waits on the order's row lock and finds it placed, with its units reserved
 '''
 @router.put('/place/{order_id}')
-def place_order(order_id: int, db: Session = Depends(get_db)):
-    update_query = db.query(models.Order).filter(models.Order.id == order_id)
-    old_order = update_query.first()
-    if old_order == None:
+async def place_order(order_id: int, db: AsyncSession = Depends(get_db)):
+    order = await db.scalar(select(models.Order).where(models.Order.id == order_id))
+    if order == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="session expired or order does not exist")
-    if old_order.status == 'placed':
-        # this should only happen when order details have passed check but payment didn't go through
-        return
-    if old_order.status == 'error':
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
-                            detail="An unexpected error occurred.")
-    if old_order.order_type == 'delivery':
-        if old_order.address_line_2:
-            addr = old_order.address_line_1 + ' ' + old_order.address_line_2 + ', ' + old_order.city + ', ' + old_order.state + ' ' + old_order.zip_code
-        else:
-            addr = old_order.address_line_1 + ', ' + old_order.city + ', ' + old_order.state + ' ' + old_order.zip_code
-        isin_range, error_message = check_addr_within_range(addr)
+    # ends the read, the connection goes back to the pool during the address check
+    await db.commit()
+    if order.status == 'created' and order.order_type == 'delivery':
+        isin_range, error_message = await check_addr_within_range(format_address(order))
         if not isin_range:
-            update_query.update({'status': 'error'})
-            db.commit()
+            await db.execute(order_transition(order_id, 'error'))
+            # in case a concurrent request placed it in the meantime
+            await release_reservations(db, models.InventoryReservation.order_id == order_id)
+            await db.commit()
             raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=error_message)
-    update_query.update({'status': 'placed'})
-    db.commit()
+    placed_id = await db.scalar(order_transition(order_id, 'placed').returning(models.Order.id))
+    if placed_id == None:
+        current = await order_status(db, order_id)
+        if current == 'placed':
+            # placed by an earlier or concurrent request, which also reserved the items
+            return
+        if current == 'error':
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail="An unexpected error occurred.")
+        raise transition_conflict(order_id, current, 'placed')
+    if not await reserve_order_inventory(db, order_id):
+        await db.rollback()
+        await db.execute(order_transition(order_id, 'error'))
+        await db.commit()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="Sorry, some items in your order are out of stock.")
+    await db.commit()
     return {"msg": "Order is placed successfully"}
 
 @router.put('/confirm/{order_id}')
-def confirm_payment(order_id: int, db: Session = Depends(get_db)):
-    update_query = db.query(models.Order).filter(models.Order.id == order_id)
-    old_order = update_query.first()
-    if old_order == None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="order does not exist")
-    update_query.update({'status': 'confirmed'})
-    db.commit()
-    txt_message = f"An order (#{old_order.reference_id}) has been placed on online store. Customer Name - {old_order.first_name} {old_order.last_name}. Order Type - {old_order.order_type}."
-    if old_order.order_type == 'delivery':
-        if old_order.address_line_2:
-            address = old_order.address_line_1 + ' ' + old_order.address_line_2 + ', ' + old_order.city + ', ' + old_order.state + ' ' + old_order.zip_code
-        else:
-            address = old_order.address_line_1 + ', ' + old_order.city + ', ' + old_order.state + ' ' + old_order.zip_code
-        txt_message += 'Address - ' + address
-    txt_message += f'\nLink - {settings.client_hostname}/order/{old_order.id}'
-    send_txt_message(settings.order_confirm_contact, "@msg.fi.google.com", txt_message)
+async def confirm_payment(order_id: int, db: AsyncSession = Depends(get_db)):
+    confirmed_order = await db.scalar(order_transition(order_id, 'confirmed').returning(models.Order))
+    if confirmed_order == None:
+        current = await order_status(db, order_id)
+        if current != 'confirmed':
+            raise transition_conflict(order_id, current, 'confirmed')
+        # a repeated confirmation, the first one already notified the store
+        return {"msg": "Success"}
+    # paid for, the reserved units no longer expire
+    await hold_reservations(db, order_id)
+    txt_message = f"An order (#{confirmed_order.reference_id}) has been placed on online store. Customer Name - {confirmed_order.first_name} {confirmed_order.last_name}. Order Type - {confirmed_order.order_type}."
+    if confirmed_order.order_type == 'delivery':
+        txt_message += 'Address - ' + format_address(confirmed_order)
+    txt_message += f'\nLink - {settings.client_hostname}/order/{confirmed_order.id}'
+    # sent by the outbox worker once the status change is committed
+    await enqueue_message(db, 'sms', settings.order_confirm_contact + "@msg.fi.google.com", txt_message)
+    await db.commit()
     return {"msg": "Success"}
 
 @router.put('/error/{order_id}')
-def payment_error(order_id: int, db: Session = Depends(get_db)):
-    update_query = db.query(models.Order).filter(models.Order.id == order_id)
-    old_order = update_query.first()
-    if old_order == None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="order does not exist")
-    update_query.update({'status': 'error'})
-    db.commit()
+async def payment_error(order_id: int, db: AsyncSession = Depends(get_db)):
+    failed_id = await db.scalar(order_transition(order_id, 'error').returning(models.Order.id))
+    if failed_id == None:
+        current = await order_status(db, order_id)
+        if current != 'error':
+            # most likely confirmed by the payment webhook in the meantime, which wins
+            raise transition_conflict(order_id, current, 'error')
+    else:
+        await release_reservations(db, models.InventoryReservation.order_id == order_id)
+        await db.commit()
     return {'msg': f'Status of order #{order_id} has been updated to error'}
 
+# loads the order with its items and products for the response
+async def order_detail(db, order_id):
+    return await db.scalar(select(models.Order).where(models.Order.id == order_id).options(ORDER_DETAIL_LOAD)
+                           .execution_options(populate_existing=True))
+
 @router.put('/accept/{order_id}', response_model=schemas.OrderDetailResponse)
-def accept_order(order_id: int, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user and user.is_admin:
-        update_query = db.query(models.Order).filter(models.Order.id == order_id)
-        old_order = update_query.first()
-        if old_order == None:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                detail="order does not exist")
-        update_query.update({'status': 'accepted'})
-        db.commit()
-        return update_query.first()
-    else:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Permission denied.")
+async def accept_order(order_id: int, admin_id: int = Depends(require_admin), db: AsyncSession = Depends(get_db)):
+    # the updated order comes back from UPDATE ... RETURNING, with its items and products loaded right after
+    accepted_order = await db.scalar(order_transition(order_id, 'accepted')
+                                     .returning(models.Order).options(ORDER_DETAIL_LOAD)
+                                     .execution_options(populate_existing=True))
+    if accepted_order == None:
+        current = await order_status(db, order_id)
+        if current != 'accepted':
+            raise transition_conflict(order_id, current, 'accepted')
+        return await order_detail(db, order_id)
+    await db.commit()
+    return accepted_order
     
 @router.put('/complete/{order_id}', response_model=schemas.OrderDetailResponse)
-def complete_order(order_id: int, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user and user.is_admin:
-        update_query = db.query(models.Order).filter(models.Order.id == order_id)
-        old_order = update_query.first()
-        if old_order == None:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                detail="order does not exist")
-        update_query.update({'status': 'completed'})
-        db.commit()
-        # update inventory
-        for item in old_order.items:
-            product_id = item.product_id
-            update_product = db.query(models.Product).filter(models.Product.id == product_id)
-            product = update_product.first()
-            update_product.update({'inventory': product.inventory - item.quantity})
-            db.commit()
-        return update_query.first()
-    else:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Permission denied.")
+async def complete_order(order_id: int, admin_id: int = Depends(require_admin), db: AsyncSession = Depends(get_db)):
+    # only one of several concurrent or repeated completions matches, so the inventory is taken once
+    completed_id = await db.scalar(order_transition(order_id, 'completed').returning(models.Order.id))
+    if completed_id == None:
+        current = await order_status(db, order_id)
+        if current != 'completed':
+            raise transition_conflict(order_id, current, 'completed')
+        return await order_detail(db, order_id)
+    # update inventory, committed together with the status
+    product_ids = await commit_order_inventory(db, order_id)
+    # inventory is part of the cached catalog and carts, only these products are reloaded
+    changed = ','.join(str(product_id) for product_id in product_ids)
+    if changed:
+        await notify_change(db, CATALOG_CHANNEL, changed)
+    await db.commit()
+    if changed:
+        catalog_changed(changed)
+    # loaded after the inventory update, so the products in the response are current
+    return await order_detail(db, order_id)
     
 @router.put('/cancel/{order_id}', response_model=schemas.OrderDetailResponse)
-def cancel_order(order_id: int, reason: schemas.OrderCancel, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user and user.is_admin:
-        update_query = db.query(models.Order).filter(models.Order.id == order_id)
-        old_order = update_query.first()
-        if old_order == None:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                detail="order does not exist")
-        update_query.update({'status': 'canceled', 'cancel_reason': reason.reason})
-        db.commit()
-        return update_query.first()
-    else:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Permission denied.")
+async def cancel_order(order_id: int, reason: schemas.OrderCancel, admin_id: int = Depends(require_admin), db: AsyncSession = Depends(get_db)):
+    canceled_order = await db.scalar(order_transition(order_id, 'canceled', cancel_reason=reason.reason)
+                                     .returning(models.Order).options(ORDER_DETAIL_LOAD)
+                                     .execution_options(populate_existing=True))
+    if canceled_order == None:
+        current = await order_status(db, order_id)
+        if current != 'canceled':
+            raise transition_conflict(order_id, current, 'canceled')
+        # canceled before, the first reason is kept
+        return await order_detail(db, order_id)
+    await release_reservations(db, models.InventoryReservation.order_id == order_id)
+    await db.commit()
+    return canceled_order
 
-@router.get('/all', response_model=List[schemas.OrderResponse])
-def get_all_orders(Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user and user.is_admin:
-        all_orders = db.query(models.Order).all()
-        return all_orders
-    else:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Permission denied.")
+@router.get('/all', response_model=schemas.Page[schemas.OrderResponse])
+async def get_all_orders(cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                         admin_id: int = Depends(require_admin), db: AsyncSession = Depends(get_db)):
+    # newest orders first
+    return ORJSONResponse(await paginate_rows(db, schemas.OrderResponse, models.Order, models.Order.id, cursor, limit, descending=True))
     
 @router.get('/detail/{id}', response_model=schemas.OrderDetailResponse)
-def get_order_detail(id: int, db: Session = Depends(get_db)):
-    order = db.query(models.Order).filter(models.Order.id == id).first()
+async def get_order_detail(id: int, db: AsyncSession = Depends(get_db)):
+    order = await db.scalar(select(models.Order).where(models.Order.id == id).options(ORDER_DETAIL_LOAD))
     if order:
         return order
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                         detail="order does not exist")
-
-'''
-Delete all orders that satisfy the one of the following:
-1. Order is created before 15 minutes ago and the order's status is either 'created' or 'error'
-2. Order is created before 20 minutes ago and the order's status is 'placed'
-'''
-def clean_expired_orders(db: Session = Depends(get_db)):
-    current_time = datetime.datetime.now()
-    fifteen_min_ago = current_time - datetime.timedelta(minutes=15)
-    twenty_min_ago = current_time - datetime.timedelta(minutes=20)
-    clean_query = db.query(models.Order).filter(((models.Order.created_at < fifteen_min_ago) &
-                                                ((models.Order.status == 'created') | (models.Order.status == 'error'))) |
-                                                ((models.Order.created_at < twenty_min_ago) & (models.Order.status == 'placed')))
-    clean_query.delete(synchronize_session=False)
-    db.commit()
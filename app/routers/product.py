@@ -1,114 +1,160 @@
-from fastapi import Response, status, HTTPException, Depends, APIRouter, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import Request, Response, status, HTTPException, Depends, APIRouter, UploadFile, Query
+from fastapi.responses import FileResponse, RedirectResponse, ORJSONResponse
 from typing import List, Optional
-from sqlalchemy.orm import Session
-from fastapi_jwt_auth import AuthJWT
-import aiofiles
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
 import os
 from ..database import get_db
+from ..auth import require_admin
 from .. import models, schemas
 from ..config import settings
+from ..cache import catalog_cache, catalog_changed, notify_change, CATALOG_CHANNEL
+from ..images import image_store, image_url, image_response, ingest_image, is_variant_filename, InvalidImage, \
+                     IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL
+from ..pagination import paginate_rows, paginate_sorted, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 router = APIRouter(prefix='/products')
 
-@router.get("/all", response_model=List[schemas.ProductResponse])
-def get_products(db: Session = Depends(get_db), search: Optional[str] = ''):
-    all_products = db.query(models.Product).filter(models.Product.name.contains(search)).all()
-    return all_products
+@router.get("/all", response_model=schemas.Page[schemas.ProductResponse])
+async def get_products(db: AsyncSession = Depends(get_db), search: Optional[str] = '', cursor: Optional[str] = None,
+                       limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    catalog = await catalog_cache.get(db)
+    if search:
+        # ranked by relevance and popularity, so search results come as a single page of at most `limit` products
+        return ORJSONResponse({'items': catalog.search(search, limit), 'next_cursor': None})
+    # already in the shape of the response_model, returning a response skips validating it again
+    return ORJSONResponse(paginate_sorted(catalog.product_dicts, catalog.product_ids, cursor, limit))
 
 @router.get("/categories", response_model=List[schemas.CategoryResponse])
-def get_categories(db: Session = Depends(get_db)):
-    all_categories = db.query(models.Product.category).distinct().all()
-    return all_categories
+async def get_categories(db: AsyncSession = Depends(get_db)):
+    return (await catalog_cache.get(db)).categories
+
+'''
+Product images, served from the catalog cache without touching the database
+/image/{id}/{version} is what catalog listings link to (image_url): its content never changes,
+so browsers and CDNs may keep it for a year. /image/{id} always serves the current image and is revalidated with its ETag.
+'''
+@router.get("/image/{id}/{version}", response_class=FileResponse)
+async def get_versioned_image(id: int, version: str, request: Request, db: AsyncSession = Depends(get_db)):
+    image = await find_image(id, db)
+    if image.version != version:
+        # the image was replaced since the url was handed out
+        return RedirectResponse(image_url(id, image), status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+    return image_response(request, image, IMMUTABLE_CACHE_CONTROL)
 
 @router.get("/image/{id}", response_class=FileResponse)
-async def get_image_by_product_id(id: int, db: Session = Depends(get_db)):
-    product = db.query(models.Product).filter(models.Product.id == id).first()
-    if product.image:
-        image_path = os.path.join(settings.image_path, product.image)
-        if os.path.exists(image_path):
-            return image_path
-        else:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+async def get_image_by_product_id(id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    return image_response(request, await find_image(id, db), REVALIDATE_CACHE_CONTROL)
+
+async def find_image(id: int, db: AsyncSession):
+    image = (await catalog_cache.get(db)).images.get(id)
+    if image == None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Image does not exist")
-    else:
+    return image
+
+# image variants are named by the hash of the upload, so they never change either
+@router.get("/images/{filename}", response_class=FileResponse)
+async def get_image_variant(filename: str, request: Request):
+    image = await asyncio.get_running_loop().run_in_executor(None, image_store.lookup, filename) if is_variant_filename(filename) else None
+    if image == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Image does not exist")
+    return image_response(request, image, IMMUTABLE_CACHE_CONTROL)
 
-@router.get("/admin", response_model=List[schemas.ProductAdminResponse])
-def get_products_admin(Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user or user.is_admin == False:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
-    all_products = db.query(models.Product).all()
-    return all_products
+@router.get("/admin", response_model=schemas.Page[schemas.ProductAdminResponse])
+async def get_products_admin(cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                             admin_id: int = Depends(require_admin), db: AsyncSession = Depends(get_db)):
+    return ORJSONResponse(await paginate_rows(db, schemas.ProductAdminResponse, models.Product, models.Product.id, cursor, limit))
     
 @router.post("", status_code=status.HTTP_201_CREATED)
-def add_product(product: schemas.ProductAdminCreate, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user or user.is_admin == False:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
-    
+async def add_product(product: schemas.ProductAdminCreate, admin_id: int = Depends(require_admin), db: AsyncSession = Depends(get_db)):
     new_product = models.Product(**product.dict())
     db.add(new_product)
-    db.commit()
+    await notify_change(db, CATALOG_CHANNEL)
+    await db.commit()
+    catalog_changed()
     return {"msg": "Item was add successfully"}
 
+'''
+Read an uploaded image and generate its variants (images.make_variants)
+Identical uploads share their files, so uploading the same photo again costs no disk space and no resizing
+'''
+async def ingest_upload(file: UploadFile):
+    data = bytearray()
+    while content := await file.read(1024 * 1024):
+        data += content
+        if len(data) > settings.image_max_upload_bytes:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail="Image is too large")
+    try:
+        return await ingest_image(bytes(data))
+    except InvalidImage:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Invalid image")
+
+@router.post("/{id}/image")
+async def upload_product_image(id: int, file: UploadFile, admin_id: int = Depends(require_admin), db: AsyncSession = Depends(get_db)):
+    variants = await ingest_upload(file)
+    product_id = await db.scalar(update(models.Product).where(models.Product.id == id)
+                                 .values(image=variants['full']['file'], image_variants=variants)
+                                 .returning(models.Product.id))
+    if product_id == None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"product with id: {id} does not exist")
+    await notify_change(db, CATALOG_CHANNEL)
+    await db.commit()
+    catalog_changed()
+    return {"msg": "Image successfully uploaded", "image": variants['full']['file'], "image_variants": variants}
+
+'''
+Upload an image by filename, products whose image is that filename are switched to the ingested image
+Returns the name the image is stored under, which is what new products should set as their image
+'''
 @router.post("/image")
-async def upload_image(file: UploadFile | None = None, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
+async def upload_image(file: UploadFile | None = None, admin_id: int = Depends(require_admin), db: AsyncSession = Depends(get_db)):
     if not file:
         return {"msg": "No upload file sent"}
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user or user.is_admin == False:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
-    async with aiofiles.open(os.path.join(settings.image_path, file.filename), 'wb') as out_file:
-        while content := await file.read(1024):  # async read chunk
-            await out_file.write(content)  # async write chunk
-    return {"msg": "Image successfully uploaded"}
+    variants = await ingest_upload(file)
+    await db.execute(update(models.Product).where(models.Product.image == os.path.basename(file.filename))
+                     .values(image=variants['full']['file'], image_variants=variants)
+                     .execution_options(synchronize_session=False))
+    # products using this file get a new image url
+    await notify_change(db, CATALOG_CHANNEL)
+    await db.commit()
+    catalog_changed()
+    return {"msg": "Image successfully uploaded", "image": variants['full']['file'], "image_variants": variants}
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_item(id: int, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user or user.is_admin == False:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
-    
-    delete_query = db.query(models.Product).filter(models.Product.id == id)
-    item_delete = delete_query.first()
+async def delete_item(id: int, admin_id: int = Depends(require_admin), db: AsyncSession = Depends(get_db)):
+    item_delete = await db.scalar(select(models.Product).where(models.Product.id == id))
     if item_delete == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"item wth id: {id} does not exist")
     
-    if item_delete.image:
+    # ingested images may be shared by other products and are left in place
+    if item_delete.image and not is_variant_filename(item_delete.image):
         try:
             os.remove(os.path.join(settings.image_path, item_delete.image))
         except OSError:
             pass
 
-    delete_query.delete(synchronize_session=False)
-    db.commit()
+    await db.execute(delete(models.Product).where(models.Product.id == id).execution_options(synchronize_session=False))
+    await notify_change(db, CATALOG_CHANNEL)
+    await db.commit()
+    catalog_changed()
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 @router.put("/{id}")
-def update_product(id: int, product: schemas.ProductAdminUpdate, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user or user.is_admin == False:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
-    
-    update_query = db.query(models.Product).filter(models.Product.id == id)
-    updated_product = update_query.first()
+async def update_product(id: int, product: schemas.ProductAdminUpdate, admin_id: int = Depends(require_admin), db: AsyncSession = Depends(get_db)):
+    updated_product = await db.scalar(select(models.Product).where(models.Product.id == id))
     if updated_product == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"product with id: {id} does not exist")
-    update_query.update(product.dict(exclude_unset=True), synchronize_session=False)
-    db.commit()
-    return {"msg": "Update successfully"}
\ No newline at end of file
+    await db.execute(update(models.Product).where(models.Product.id == id)
+                     .values(product.dict(exclude_unset=True)).execution_options(synchronize_session=False))
+    await notify_change(db, CATALOG_CHANNEL)
+    await db.commit()
+    catalog_changed()
+    return {"msg": "Update successfully"}
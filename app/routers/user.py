@@ -1,88 +1,107 @@
-from fastapi import status, HTTPException, Depends, APIRouter
-from typing import List
-from sqlalchemy.orm import Session
+from fastapi import status, HTTPException, Depends, APIRouter, Query
+from typing import Optional
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi_jwt_auth import AuthJWT
 import datetime
 from ..database import get_db
+from ..auth import create_access_token, get_current_user_id, get_current_user
 from .. import models, schemas
-from ..utils import get_password_hash, verify_password, send_verification_email
+from ..utils import get_password_hash, verify_password, verify_and_update_password
+from ..outbox import enqueue_message
 from ..config import settings
+from .order import ORDER_DETAIL_LOAD
+from ..pagination import paginate, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 router = APIRouter(prefix='/user')
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
-async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     # hash the password
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user.password = hashed_password
 
     new_user = models.User(**user.dict())
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    # email verification
-    await send_verification_email(user.email)
+    # email verification, sent by the outbox worker once the user is committed
+    await enqueue_message(db, 'verification_email', user.email)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # ix_users_email is unique
+        await db.rollback()
+        raise email_taken()
     return {"msg":"Successfully registered"}
 
+def email_taken():
+    return HTTPException(status_code=status.HTTP_409_CONFLICT,
+                         detail="Email already registered")
+
 @router.put('/edit_profile')
-def edit_profile(user_edit: schemas.UserProfileChange, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user:
-        update_query = db.query(models.User).filter(models.User.id == user.id)
-        update_query.update(user_edit.dict(), synchronize_session=False)
-        db.commit()
+async def edit_profile(user_edit: schemas.UserProfileChange, user_id: int = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    try:
+        updated_id = await db.scalar(update(models.User).where(models.User.id == user_id).values(user_edit.dict())
+                                     .returning(models.User.id).execution_options(synchronize_session=False))
+    except IntegrityError:
+        await db.rollback()
+        raise email_taken()
+    if updated_id:
+        await db.commit()
         return {"first_name": user_edit.first_name, "msg": "Profile has been successfully updated."}
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="User not found")
 
 @router.put('/change_address')
-def change_address(addr: schemas.Address, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user:
-        update_query = db.query(models.User).filter(models.User.id == user.id)
-        update_query.update(addr.dict(), synchronize_session=False)
-        db.commit()
+async def change_address(addr: schemas.Address, user_id: int = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    updated_id = await db.scalar(update(models.User).where(models.User.id == user_id).values(addr.dict())
+                                 .returning(models.User.id).execution_options(synchronize_session=False))
+    if updated_id:
+        await db.commit()
         return {"msg": "Address has been successfully updated."}
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="User not found")
 
 @router.put('/change_password')
-def change_password(passwords: schemas.UserChangePassword, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user and verify_password(passwords.old_password, user.password):
-        hashed_password = get_password_hash(passwords.new_password)
-        update_query = db.query(models.User).filter(models.User.id == user.id)
-        update_query.update({"password": hashed_password}, synchronize_session=False)
-        db.commit()
+async def change_password(passwords: schemas.UserChangePassword, user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    if await verify_password(passwords.old_password, user.password):
+        hashed_password = await get_password_hash(passwords.new_password)
+        await db.execute(update(models.User).where(models.User.id == user.id)
+                         .values(password=hashed_password).execution_options(synchronize_session=False))
+        await db.commit()
         return {"msg": "Your password has been successfully updated."}
-    elif user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="User not found")
     else:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Old password you entered does not match the information we have on file")
 
-@router.post('/login')
-def login(user_credentials: schemas.UserLogin, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == user_credentials.email).first()
+'''
+Look up the user by email and check the password
+A password hashed with an outdated bcrypt cost is rehashed with the current one
+'''
+async def authenticate(user_credentials: schemas.UserLogin, db: AsyncSession):
+    user = await db.scalar(select(models.User).where(models.User.email == user_credentials.email))
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Credentials")
     
-    if not verify_password(user_credentials.password, user.password):
+    is_valid, new_hash = await verify_and_update_password(user_credentials.password, user.password)
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Credentials"
         )
+    if new_hash:
+        await db.execute(update(models.User).where(models.User.id == user.id)
+                         .values(password=new_hash).execution_options(synchronize_session=False))
+        await db.commit()
+    return user
+
+@router.post('/login')
+async def login(user_credentials: schemas.UserLogin, Authorize: AuthJWT = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await authenticate(user_credentials, db)
     at_expires = datetime.timedelta(minutes=settings.access_token_expire_minutes)
     rt_expires = datetime.timedelta(days=settings.refresh_token_expire_days)
-    access_token = Authorize.create_access_token(subject=user.id, expires_time=at_expires)
+    access_token = create_access_token(Authorize, user, at_expires)
     refresh_token = Authorize.create_refresh_token(subject=user.id, expires_time=rt_expires)
 
     # Set the JWT cookies in the response
@@ -91,24 +110,17 @@ def login(user_credentials: schemas.UserLogin, Authorize: AuthJWT = Depends(), d
     return {"access_token": access_token, "first_name": user.first_name, "is_admin": user.is_admin}
 
 @router.post('/login_no_refresh')
-def login_no_refresh(user_credentials: schemas.UserLogin, Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == user_credentials.email).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Credentials")
-    
-    if not verify_password(user_credentials.password, user.password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Credentials"
-        )
+async def login_no_refresh(user_credentials: schemas.UserLogin, Authorize: AuthJWT = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await authenticate(user_credentials, db)
     at_expires = datetime.timedelta(hours=2)
-    access_token = Authorize.create_access_token(subject=user.id, expires_time=at_expires)
+    access_token = create_access_token(Authorize, user, at_expires)
 
     # Set the JWT cookies in the response
     Authorize.set_access_cookies(access_token)
     return {"access_token": access_token, "first_name": user.first_name, "is_admin": user.is_admin}
 
 @router.post('/refresh')
-def refresh(Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
+async def refresh(Authorize: AuthJWT = Depends(), db: AsyncSession = Depends(get_db)):
     """
     The jwt_refresh_token_required() function insures a valid refresh
     token is present in the request before running any code below that function.
@@ -118,10 +130,11 @@ def refresh(Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
     Authorize.jwt_refresh_token_required()
 
     user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = await db.scalar(select(models.User).where(models.User.id == user_id))
     if user:
         at_expires = datetime.timedelta(minutes=settings.access_token_expire_minutes)
-        new_access_token = Authorize.create_access_token(subject=user_id, expires_time=at_expires)
+        # the new token carries the user's current role
+        new_access_token = create_access_token(Authorize, user, at_expires)
         Authorize.set_access_cookies(new_access_token)
         return {"access_token": new_access_token, "first_name": user.first_name, "is_admin": user.is_admin}
     else:
@@ -129,45 +142,30 @@ def refresh(Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
                             detail="Invalid token or expired token")
 
 @router.delete('/logout')
-def logout(Authorize: AuthJWT = Depends()):
+async def logout(Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
 
     Authorize.unset_jwt_cookies()
     return {"msg": "Successfully logout"}
 
 @router.get('/profile', response_model=schemas.UserProfileResponse)
-def profile(Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user:
-        return user
-    else:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Invalid token or expired token")
+async def profile(user: models.User = Depends(get_current_user)):
+    return user
 
 @router.post('/verify_email')
-def verify_email(Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user:
-        update_query = db.query(models.User).filter(models.User.id == user.id)
-        update_query.update({"is_verified": True}, synchronize_session=False)
-        db.commit()
+async def verify_email(user_id: int = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    updated_id = await db.scalar(update(models.User).where(models.User.id == user_id).values(is_verified=True)
+                                 .returning(models.User.id).execution_options(synchronize_session=False))
+    if updated_id:
+        await db.commit()
         return {"msg": "Success"}
     else:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Invalid token or expired token")
     
-@router.get('/orders', response_model=List[schemas.OrderDetailResponse])
-def get_orders_by_user(Authorize: AuthJWT = Depends(), db: Session = Depends(get_db)):
-    Authorize.jwt_required()
-    user_id = Authorize.get_jwt_subject()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user:
-        user_orders = db.query(models.Order).filter((models.Order.user_id == user_id) & ((models.Order.status == 'confirmed') | (models.Order.status == 'accepted') | (models.Order.status == 'completed') | (models.Order.status == 'canceled'))).all()
-        return user_orders
-    else:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail="Invalid token or expired token")
\ No newline at end of file
+@router.get('/orders', response_model=schemas.Page[schemas.OrderDetailResponse])
+async def get_orders_by_user(cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                             user_id: int = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    user_orders = select(models.Order).where((models.Order.user_id == user_id) & ((models.Order.status == 'confirmed') | (models.Order.status == 'accepted') | (models.Order.status == 'completed') | (models.Order.status == 'canceled'))) \
+                                      .options(ORDER_DETAIL_LOAD)
+    return await paginate(db, user_orders, models.Order.id, cursor, limit, descending=True)
\ No newline at end of file
@@ -1,7 +1,14 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from pydantic.generics import GenericModel
+from typing import Optional, List, Dict, Generic, TypeVar
 from datetime import datetime
 
+T = TypeVar('T')
+
+class Page(GenericModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str]
+
 class Product(BaseModel):
     name: str
     price: float
@@ -11,9 +18,18 @@ class Product(BaseModel):
     subcategory: Optional[str]
     description: Optional[str]
 
+class ImageVariant(BaseModel):
+    url: str
+    width: int
+    height: int
+
 class ProductResponse(Product):
     id: int
     popularity: int
+    # content-hashed url of the product image, only set for catalog listings
+    image_url: Optional[str]
+    # thumb, card and full size variants of the image, only set for catalog listings
+    images: Optional[Dict[str, ImageVariant]]
     class Config:
         orm_mode = True
 
@@ -21,6 +37,7 @@ class ProductAdminResponse(Product):
     id: int
     sku: Optional[str]
     image: Optional[str]
+    image_variants: Optional[Dict[str, Dict]]
     cost: float
     popularity: int
     created_at: datetime
@@ -100,6 +117,16 @@ class CartItem(Product):
 class UserCart(BaseModel):
     items: List[CartItem]
 
+class QuotedProduct(BaseModel):
+    price: float
+    inventory: int
+
+class CartQuote(BaseModel):
+    subtotal: float
+    total: float
+    # the product rows the quote was priced from, by product id
+    products: Dict[int, QuotedProduct]
+
 class OrderItem(BaseModel):
     id: int
     product: ProductResponse
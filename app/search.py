@@ -0,0 +1,109 @@
+from collections import defaultdict
+import math
+import re
+
+# how much a match in each field counts towards a product's relevance
+FIELD_WEIGHTS = {'name': 1.0, 'category': 0.6, 'subcategory': 0.6, 'description': 0.3}
+# minimum trigram similarity for a catalog word to count as a (possibly misspelled) match
+MIN_SIMILARITY = 0.25
+# a word that starts with the query token is scored like a near-exact match, so partially typed words match
+PREFIX_SIMILARITY = 0.9
+# at most this share of the final score comes from popularity, the rest from text relevance
+POPULARITY_BLEND = 0.2
+
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+
+def tokenize(value):
+    if not value:
+        return []
+    return WORD_PATTERN.findall(value.lower())
+
+'''
+Trigrams of a single word, padded the same way pg_trgm does it ('  w', ' wo', ..., 'rd ')
+so that short words and word boundaries still produce trigrams.
+'''
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+'''
+Trigram index over the words of the catalog's name, category, subcategory and description fields.
+Built once per catalog snapshot; every query only touches the postings of its own trigrams.
+'''
+class SearchIndex:
+    def __init__(self, products):
+        self.products = products
+        self.words = []
+        self.word_trigram_counts = []
+        # trigram -> ids of the words containing it
+        self.postings = defaultdict(list)
+        # word id -> {product index: best field weight of the word in that product}
+        self.word_products = []
+        word_ids = {}
+        for index, product in enumerate(products):
+            for field, weight in FIELD_WEIGHTS.items():
+                for word in tokenize(getattr(product, field)):
+                    word_id = word_ids.get(word)
+                    if word_id is None:
+                        word_id = word_ids[word] = len(self.words)
+                        self.words.append(word)
+                        word_trigrams = trigrams(word)
+                        self.word_trigram_counts.append(len(word_trigrams))
+                        for trigram in word_trigrams:
+                            self.postings[trigram].append(word_id)
+                        self.word_products.append({})
+                    matches = self.word_products[word_id]
+                    if matches.get(index, 0) < weight:
+                        matches[index] = weight
+        self.max_popularity = max((product.popularity for product in products), default=0)
+
+    '''
+    Similarity of every indexed word that shares at least one trigram with the token
+    and is close enough to count as a match.
+    '''
+    def _similar_words(self, token):
+        token_trigrams = trigrams(token)
+        shared = defaultdict(int)
+        for trigram in token_trigrams:
+            for word_id in self.postings.get(trigram, ()):
+                shared[word_id] += 1
+        similar = {}
+        for word_id, count in shared.items():
+            similarity = count / (len(token_trigrams) + self.word_trigram_counts[word_id] - count)
+            if similarity < 1 and self.words[word_id].startswith(token):
+                similarity = max(similarity, PREFIX_SIMILARITY)
+            if similarity >= MIN_SIMILARITY:
+                similar[word_id] = similarity
+        return similar
+
+    '''
+    Return up to `limit` products matching every word of the query, best first.
+    Relevance is the sum over query words of the best (similarity * field weight) match,
+    blended with the product's popularity.
+    '''
+    def search(self, query, limit):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        scores = None
+        for token in tokens:
+            token_scores = {}
+            for word_id, similarity in self._similar_words(token).items():
+                for index, weight in self.word_products[word_id].items():
+                    score = similarity * weight
+                    if token_scores.get(index, 0) < score:
+                        token_scores[index] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {index: score + token_scores[index] for index, score in scores.items() if index in token_scores}
+            if not scores:
+                return []
+        popularity_scale = math.log1p(max(self.max_popularity, 0)) or 1
+        ranked = []
+        for index, score in scores.items():
+            popularity = math.log1p(max(self.products[index].popularity, 0)) / popularity_scale
+            relevance = score / len(tokens)
+            ranked.append(((1 - POPULARITY_BLEND) * relevance + POPULARITY_BLEND * popularity, index))
+        ranked.sort(key=lambda match: (-match[0], match[1]))
+        return [self.products[index] for _, index in ranked[:limit]]
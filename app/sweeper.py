@@ -0,0 +1,105 @@
+from sqlalchemy import select, delete, func, and_, or_
+import asyncio
+import datetime
+import logging
+from . import models
+from .config import settings
+from .database import engine
+from .inventory import release_reservations
+
+logger = logging.getLogger(__name__)
+
+# key of the advisory lock held by the worker that is sweeping, any fixed number unique to this app
+SWEEPER_LOCK_ID = 7310425
+
+# how long an unfinished order is kept before it is deleted, by status
+ORDER_EXPIRY = {
+    'created': datetime.timedelta(minutes=15),
+    'error': datetime.timedelta(minutes=15),
+    'placed': datetime.timedelta(minutes=20),
+}
+
+def expired_orders():
+    # one (status, created_at) range per status, each of them is a scan of ix_orders_unfinished_created_at
+    return or_(*(and_(models.Order.status == order_status, models.Order.created_at < func.now() - expiry)
+                 for order_status, expiry in ORDER_EXPIRY.items()))
+
+'''
+Release expired inventory reservations, then delete expired orders
+in batches of order_sweep_batch_size, committing after every batch
+so no single transaction holds locks on many rows.
+Only one worker sweeps at a time: the sweep runs while holding a session-level advisory lock,
+and workers that can't take the lock skip their turn.
+Returns the number of orders deleted, or None if another worker was sweeping.
+'''
+async def sweep_expired_orders():
+    async with engine.connect() as conn:
+        if not await conn.scalar(select(func.pg_try_advisory_lock(SWEEPER_LOCK_ID))):
+            return None
+        await conn.commit()
+        removed = 0
+        try:
+            # unpaid orders whose reservation ran out give their units back
+            await release_reservations(conn, models.InventoryReservation.expires_at < func.now())
+            await conn.commit()
+            while True:
+                order_ids = (await conn.scalars(select(models.Order.id).where(expired_orders())
+                                                .limit(settings.order_sweep_batch_size)
+                                                .with_for_update(skip_locked=True))).all()
+                if order_ids:
+                    # reservations would otherwise be deleted by the cascade without giving their units back
+                    await release_reservations(conn, models.InventoryReservation.order_id.in_(order_ids))
+                    await conn.execute(delete(models.Order).where(models.Order.id.in_(order_ids)))
+                await conn.commit()
+                removed += len(order_ids)
+                if len(order_ids) < settings.order_sweep_batch_size:
+                    return removed
+        finally:
+            try:
+                # a failed statement leaves the transaction aborted, and the unlock would fail along with it
+                await conn.rollback()
+                await conn.execute(select(func.pg_advisory_unlock(SWEEPER_LOCK_ID)))
+                await conn.commit()
+            except Exception:
+                # the lock belongs to the session, so a connection that may still hold it must not go back to the pool
+                logger.exception('releasing the sweeper lock failed')
+                await conn.invalidate()
+
+'''
+Background task that sweeps expired orders every order_sweep_interval_seconds.
+Every worker runs one, the advisory lock makes sure only one of them sweeps at a time.
+'''
+class OrderSweeper:
+    def __init__(self):
+        self._task = None
+        self.removed_total = 0
+        self.last_removed = None
+        self.last_swept_at = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            try:
+                removed = await sweep_expired_orders()
+            except Exception:
+                logger.exception('expired order sweep failed')
+                removed = None
+            if removed is not None:
+                self.removed_total += removed
+                self.last_removed = removed
+                self.last_swept_at = datetime.datetime.now()
+                if removed:
+                    logger.info('swept %d expired orders', removed)
+            await asyncio.sleep(settings.order_sweep_interval_seconds)
+
+order_sweeper = OrderSweeper()
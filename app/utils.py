@@ -1,36 +1,38 @@
 from passlib.context import CryptContext
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 from pydantic import EmailStr
-import smtplib
-import requests
-import json
-import urllib.parse
+from email.message import EmailMessage
 from .config import settings
+from .clients import maps_client, stripe_client, UpstreamUnavailable
 
 METER_TO_MILE = 0.000621371
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+# hashes made with any other cost than bcrypt_rounds need an update, so a cost change is rolled out on login
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto',
+                           bcrypt__default_rounds=settings.bcrypt_rounds,
+                           bcrypt__min_rounds=settings.bcrypt_rounds,
+                           bcrypt__max_rounds=settings.bcrypt_rounds)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# bcrypt releases the GIL, so a few dedicated threads hash in parallel
+# without blocking the event loop or using up the threadpool of sync routes
+password_executor = ThreadPoolExecutor(max_workers=settings.password_hash_workers, thread_name_prefix='password-hash')
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def get_password_hash(password):
+    return await asyncio.get_running_loop().run_in_executor(password_executor, pwd_context.hash, password)
 
-async def send_verification_email(email: EmailStr):
-    conf = ConnectionConfig(
-        MAIL_USERNAME = settings.smtp_email,
-        MAIL_PASSWORD = settings.smtp_pwd,
-        MAIL_FROM = settings.smtp_email,
-        MAIL_PORT = 587,
-        MAIL_SERVER = "smtp.gmail.com",
-        MAIL_STARTTLS = True,
-        MAIL_SSL_TLS = False,
-        USE_CREDENTIALS = True,
-        VALIDATE_CERTS = True
-    )
+async def verify_password(plain_password, hashed_password):
+    return await asyncio.get_running_loop().run_in_executor(password_executor, pwd_context.verify, plain_password, hashed_password)
 
-    html = f"""
+'''
+Verify a password and, if its hash was made with outdated settings, rehash it in the same pass
+Returns two values: (a boolean that indicates if the password matches, the new hash or None)
+'''
+async def verify_and_update_password(plain_password, hashed_password):
+    return await asyncio.get_running_loop().run_in_executor(password_executor, pwd_context.verify_and_update, plain_password, hashed_password)
+
+# rendered once at import, every verification email has the same body
+VERIFICATION_EMAIL_HTML = f"""
             <!DOCTYPE html>
                 <html>
                 <head>
@@ -59,51 +61,60 @@ async def send_verification_email(email: EmailStr):
                 </html>
             """
 
+def build_verification_email(email: EmailStr) -> EmailMessage:
+    message = EmailMessage()
+    message['Subject'] = "Bargain Liquor Account Verification"
+    message['From'] = settings.smtp_email
+    message['To'] = email
+    message.set_content(VERIFICATION_EMAIL_HTML, subtype='html')
+    return message
 
-    message = MessageSchema(
-        subject="Bargain Liquor Account Verification",
-        recipients=[email],
-        body=html,
-        subtype=MessageType.html)
-
-    fm = FastMail(conf)
-    await fm.send_message(message)
-
-def send_txt_message(phone_number, carrier, message):
-    recipient = phone_number + carrier
-    auth = (settings.smtp_email, settings.smtp_pwd)
- 
-    server = smtplib.SMTP("smtp.gmail.com", 587)
-    server.starttls()
-    server.login(auth[0], auth[1])
- 
-    server.sendmail(auth[0], recipient, message)
+class DistanceLookupError(Exception):
+    pass
 
 '''
-Check if the given address is within our delivery range
-Returns two values: (a boolean that indicates if the address is within our range, error message)
+Driving distance in miles from the store to the given address, using the Google Distance Matrix API
+Returns None if the address could not be found, raises DistanceLookupError if the API call itself failed
 '''
-def check_addr_within_range(customer_addr):
-    origin = urllib.parse.quote(settings.store_addr)
-    destination = urllib.parse.quote(customer_addr)
+async def get_distance_miles(customer_addr):
     GOOGLE_MAP_API_KEY = settings.google_map_api_key
 
-    url = f'https://maps.googleapis.com/maps/api/distancematrix/json?origins={origin}&destinations={destination}&units=imperial&key={GOOGLE_MAP_API_KEY}'
+    url = f'{settings.google_map_api_base}/maps/api/distancematrix/json'
+    params = {'origins': settings.store_addr, 'destinations': customer_addr, 'units': 'imperial', 'key': GOOGLE_MAP_API_KEY}
 
-    payload={}
-    headers = {}
-
-    response = requests.request("GET", url, headers=headers, data=payload)
-    res_dict = json.loads(response.text)
+    try:
+        response = await maps_client.request("GET", url, params=params)
+        res_dict = response.json()
+    except (UpstreamUnavailable, ValueError) as e:
+        raise DistanceLookupError(str(e))
     if res_dict['status'] != 'OK':
-        return False, 'Sorry, something went wrong.'
+        raise DistanceLookupError(res_dict['status'])
     if res_dict['rows'][0]['elements'][0]['status'] != 'OK':
-        return False, 'The address you entered could not be found.'
-    else:
-        dist_meter = res_dict['rows'][0]['elements'][0]['distance']['value'] 
-        dist_mi = dist_meter * METER_TO_MILE
-        if dist_mi > settings.delivery_range:
-            return False, 'Sorry, the address you entered is out of our delivery range.'
-        else:
-            return True, ''
+        return None
+    dist_meter = res_dict['rows'][0]['elements'][0]['distance']['value']
+    return dist_meter * METER_TO_MILE
+
+class PaymentError(Exception):
+    pass
 
+'''
+Create a Stripe PaymentIntent and return its client secret
+Stripe replays the original response for a repeated idempotency key, so retrying with the same key never charges twice
+Raises PaymentError with Stripe's message if the intent was rejected, UpstreamUnavailable if Stripe could not be reached
+'''
+async def create_payment_intent(amount, receipt_email, description, idempotency_key):
+    response = await stripe_client.request("POST", f'{settings.stripe_api_base}/v1/payment_intents',
+                                           auth=(settings.stripe_api_key, ''),
+                                           headers={'Idempotency-Key': idempotency_key},
+                                           data={'amount': amount,
+                                                 'currency': 'usd',
+                                                 'automatic_payment_methods[enabled]': 'true',
+                                                 'receipt_email': receipt_email,
+                                                 'description': description})
+    try:
+        res_dict = response.json()
+    except ValueError:
+        raise PaymentError(f'Unexpected response from Stripe ({response.status_code})')
+    if response.status_code != 200:
+        raise PaymentError(res_dict.get('error', {}).get('message', f'Stripe returned {response.status_code}'))
+    return res_dict['client_secret']
@@ -0,0 +1,81 @@
+'''
+Contention benchmark for inventory reservations on a single hot product.
+Creates a product with `stock` units and `orders` one-unit orders for it, then places the orders
+from `clients` concurrent clients and reports reservations/sec, and checks that the product
+was not oversold: exactly min(stock, orders) reservations may succeed.
+The product and its orders are deleted again at the end.
+
+Runs against the database configured in .env. Concurrency is capped by the connection pool,
+raise DB_POOL_SIZE / DB_MAX_OVERFLOW to let more clients hit the product row at once.
+Usage: python scripts/bench_reservations.py [stock] [orders] [clients]
+'''
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import select, delete, insert
+from app import models
+from app.database import SessionLocal, engine
+from app.inventory import reserve_order_inventory
+
+async def create_orders(product_id, count):
+    async with SessionLocal() as db:
+        order_ids = (await db.scalars(insert(models.Order).returning(models.Order.id),
+                                      [{'subtotal': 1, 'total': 1, 'order_type': 'pick up', 'status': 'created',
+                                        'first_name': 'bench', 'last_name': 'bench', 'email': 'bench@example.com',
+                                        'phone': '0'} for _ in range(count)])).all()
+        await db.execute(insert(models.OrderItem),
+                         [{'order_id': order_id, 'product_id': product_id, 'quantity': 1} for order_id in order_ids])
+        await db.commit()
+        return order_ids
+
+async def place(order_ids, results):
+    while order_ids:
+        order_id = order_ids.pop()
+        async with SessionLocal() as db:
+            start = time.perf_counter()
+            if await reserve_order_inventory(db, order_id):
+                await db.commit()
+                results['reserved'] += 1
+            else:
+                await db.rollback()
+                results['sold_out'] += 1
+            results['latencies'].append(time.perf_counter() - start)
+
+async def main(stock, orders, clients):
+    async with SessionLocal() as db:
+        product = models.Product(name='bench hot product', category='bench', price=1, inventory=stock)
+        db.add(product)
+        await db.commit()
+    order_ids = await create_orders(product.id, orders)
+    try:
+        results = {'reserved': 0, 'sold_out': 0, 'latencies': []}
+        start = time.perf_counter()
+        await asyncio.gather(*(place(order_ids, results) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+        async with SessionLocal() as db:
+            reserved = await db.scalar(select(models.Product.reserved).where(models.Product.id == product.id))
+        latencies = sorted(results['latencies'])
+        print(f'{orders} orders for {stock} units from {clients} clients in {elapsed:.2f}s')
+        print(f'{results["reserved"]} reserved, {results["sold_out"]} sold out: '
+              f'{results["reserved"] / elapsed:.0f} reservations/sec, {orders / elapsed:.0f} attempts/sec')
+        print(f'latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, '
+              f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms')
+        expected = min(stock, orders)
+        print('ok' if reserved == results['reserved'] == expected else f'OVERSOLD: product.reserved={reserved}, expected {expected}')
+    finally:
+        async with SessionLocal() as db:
+            await db.execute(delete(models.Product).where(models.Product.id == product.id))
+            await db.execute(delete(models.Order).where(models.Order.email == 'bench@example.com'))
+            await db.commit()
+        await engine.dispose()
+
+if __name__ == '__main__':
+    stock = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    orders = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    clients = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    asyncio.run(main(stock, orders, clients))
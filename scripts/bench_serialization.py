@@ -0,0 +1,88 @@
+'''
+Serialization cost of the large list responses, per thousand rows, before and after the fast path.
+before: ORM objects validated against the endpoint's response_model and encoded with the json module,
+        which is what FastAPI does with a returned value.
+after:  plain dicts (the catalog snapshot's product_dicts, or paginate_rows() rows built from result tuples)
+        encoded with orjson, which is what the endpoints now return.
+Needs no database, the rows are built in memory.
+Usage: python scripts/bench_serialization.py [rows] [repeat]
+'''
+import asyncio
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from app import models, schemas
+
+def make_products(count):
+    now = datetime.datetime.now()
+    return [models.Product(id=i, sku=f'SKU{i:06d}', name=f'Product {i}', size='750ml', category='wine',
+                           subcategory='red', description='A dry red wine with notes of cherry and oak',
+                           popularity=i % 500, inventory=100, reserved=0, cost=7.5, price=12.99,
+                           image=f'{i:064x}_full.webp', image_variants=None, created_at=now)
+            for i in range(1, count + 1)]
+
+def make_orders(count):
+    now = datetime.datetime.now()
+    return [models.Order(id=i, user_id=1, subtotal=42.5, total=49.86, order_type='delivery', status='completed',
+                         first_name='Jane', last_name='Doe', email='jane@example.com', phone='5555550100',
+                         address_line_1='1 Main St', address_line_2=None, city='Springfield', state='CA',
+                         zip_code='90000', schedule=None, tip=3.0, reference_id=f'20261018{i}',
+                         cancel_reason=None, created_at=now)
+            for i in range(1, count + 1)]
+
+def as_rows(objects, schema):
+    # what the database returns for a column-projected query
+    names = list(schema.__fields__)
+    return names, [tuple(getattr(obj, name) for name in names) for obj in objects]
+
+async def before(schema, items):
+    field = create_response_field(name='bench', type_=schemas.Page[schema])
+    content = await serialize_response(field=field, response_content={'items': items, 'next_cursor': None})
+    return JSONResponse(content).body
+
+def after(items):
+    return ORJSONResponse({'items': items, 'next_cursor': None}).body
+
+def after_rows(names, rows):
+    return after([dict(zip(names, row)) for row in rows])
+
+async def timed(run, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = run()
+        if asyncio.iscoroutine(body):
+            body = await body
+    return (time.perf_counter() - start) / repeat, len(body)
+
+async def main(count, repeat):
+    products = make_products(count)
+    catalog = [schemas.ProductResponse.from_orm(product) for product in products]
+    catalog_dicts = [product.dict() for product in catalog]
+    orders = make_orders(count)
+    product_names, product_rows = as_rows(products, schemas.ProductAdminResponse)
+    order_names, order_rows = as_rows(orders, schemas.OrderResponse)
+
+    cases = [
+        ('/products/all', lambda: before(schemas.ProductResponse, catalog), lambda: after(catalog_dicts)),
+        ('/products/admin', lambda: before(schemas.ProductAdminResponse, products), lambda: after_rows(product_names, product_rows)),
+        ('/order/all', lambda: before(schemas.OrderResponse, orders), lambda: after_rows(order_names, order_rows)),
+    ]
+    per_thousand = 1000 / count
+    print(f'{count} rows, mean of {repeat} runs, ms per 1000 rows')
+    for endpoint, run_before, run_after in cases:
+        before_seconds, before_bytes = await timed(run_before, repeat)
+        after_seconds, after_bytes = await timed(run_after, repeat)
+        print(f'{endpoint:16} before {before_seconds * 1000 * per_thousand:7.2f}  after {after_seconds * 1000 * per_thousand:6.2f}  '
+              f'{before_seconds / after_seconds:5.1f}x faster  ({before_bytes} / {after_bytes} bytes)')
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    asyncio.run(main(count, repeat))
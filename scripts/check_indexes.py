@@ -0,0 +1,79 @@
+'''
+Check that the hot queries are planned with the index meant for them.
+Runs EXPLAIN for each query with sequential scans disabled (a small or empty development table
+would otherwise be scanned whatever indexes exist), and fails if the expected index is not in the plan.
+Run after `alembic upgrade head` against the database configured in .env.
+Usage: python scripts/check_indexes.py
+'''
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import select, func, text
+from sqlalchemy.sql.expression import Executable, ClauseElement
+from sqlalchemy.ext.compiler import compiles
+from app import models
+from app.database import engine
+from app.sweeper import expired_orders
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+@compiles(Explain, 'postgresql')
+def compile_explain(element, compiler, **kw):
+    return 'EXPLAIN ' + compiler.process(element.statement, **kw)
+
+# (description, query as the app runs it, index it should use)
+HOT_QUERIES = [
+    ('login by email',
+     select(models.User).where(models.User.email == 'customer@example.com'),
+     'ix_users_email'),
+    ('order history of a customer',
+     select(models.Order).where((models.Order.user_id == 1) & ((models.Order.status == 'confirmed') | (models.Order.status == 'accepted') | (models.Order.status == 'completed') | (models.Order.status == 'canceled')))
+                         .order_by(models.Order.id.desc()).limit(51),
+     'ix_orders_user_history'),
+    ('items of a page of orders',
+     select(models.OrderItem).where(models.OrderItem.order_id.in_([1, 2, 3])),
+     'ix_order_items_order_id'),
+    ('expired orders for the sweeper',
+     select(models.Order.id).where(expired_orders()).limit(500),
+     'ix_orders_unfinished_created_at'),
+    ('cart of a user',
+     select(models.CartItem.quantity, models.Product.name)
+         .join(models.Product, models.Product.id == models.CartItem.product_id)
+         .where(models.CartItem.user_id == 1),
+     'carts_user_id_product_id_key'),
+    ('reservations of an order',
+     select(models.InventoryReservation).where(models.InventoryReservation.order_id == 1),
+     'ix_inventory_reservations_order_id'),
+    ('expired reservations',
+     select(models.InventoryReservation).where(models.InventoryReservation.expires_at < func.now()),
+     'ix_inventory_reservations_expires_at'),
+    ('pending outbox messages',
+     select(models.OutboxMessage).where(models.OutboxMessage.status == 'pending',
+                                        models.OutboxMessage.next_attempt_at <= func.now())
+                                 .order_by(models.OutboxMessage.id).limit(50),
+     'ix_outbox_messages_pending'),
+]
+
+async def main():
+    failed = 0
+    async with engine.connect() as conn:
+        await conn.execute(text('SET enable_seqscan = off'))
+        for description, query, index in HOT_QUERIES:
+            plan = '\n'.join((await conn.execute(Explain(query))).scalars())
+            if index in plan:
+                print(f'ok      {description}: {index}')
+            else:
+                failed += 1
+                print(f'MISSING {description}: expected {index}, got\n{plan}')
+    await engine.dispose()
+    return failed
+
+if __name__ == '__main__':
+    sys.exit(1 if asyncio.run(main()) else 0)
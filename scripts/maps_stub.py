@@ -0,0 +1,41 @@
+'''
+Local stand-in for the Google Distance Matrix API, for tests and benchmarks.
+Point the app at it with GOOGLE_MAP_API_BASE=http://127.0.0.1:8081
+
+Every destination is 1 mile away per 1000 of its zip code (so zip 05000 is 5 miles away),
+destinations containing "nowhere" are not found, and requests with the key "fail" get an error status.
+Usage: python scripts/maps_stub.py [port]
+'''
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import sys
+import urllib.parse
+
+METERS_PER_MILE = 1609.344
+
+class DistanceMatrixStub(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        destination = query.get('destinations', [''])[0]
+        if query.get('key', [''])[0] == 'fail':
+            body = {'status': 'REQUEST_DENIED', 'rows': []}
+        elif 'nowhere' in destination.lower():
+            body = {'status': 'OK', 'rows': [{'elements': [{'status': 'NOT_FOUND'}]}]}
+        else:
+            zip_codes = re.findall(r'\b\d{5}\b', destination)
+            miles = int(zip_codes[-1]) / 1000 if zip_codes else 1
+            body = {'status': 'OK', 'rows': [{'elements': [{'status': 'OK', 'distance': {'value': round(miles * METERS_PER_MILE)}}]}]}
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    ThreadingHTTPServer(('127.0.0.1', port), DistanceMatrixStub).serve_forever()
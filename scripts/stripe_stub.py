@@ -0,0 +1,56 @@
+'''
+Local stand-in for the Stripe PaymentIntents API, for tests and benchmarks.
+Point the app at it with STRIPE_API_BASE=http://127.0.0.1:8082
+
+POST /v1/payment_intents returns a new intent, or the intent created earlier with the same Idempotency-Key.
+Amounts below 50 (cents) are rejected with a 400 card error like Stripe does.
+Every response is delayed by `delay` seconds to simulate a slow Stripe.
+Usage: python scripts/stripe_stub.py [port] [delay]
+'''
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+DELAY_SECONDS = 0
+intents_by_key = {}
+intents_lock = threading.Lock()
+
+class PaymentIntentStub(BaseHTTPRequestHandler):
+    def do_POST(self):
+        time.sleep(DELAY_SECONDS)
+        length = int(self.headers.get('Content-Length', 0))
+        form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+        if self.path != '/v1/payment_intents':
+            return self.respond(404, {'error': {'type': 'invalid_request_error', 'message': 'Unrecognized request URL'}})
+        amount = int(form.get('amount', ['0'])[0])
+        if amount < 50:
+            return self.respond(400, {'error': {'type': 'invalid_request_error', 'message': 'Amount must be at least $0.50 usd'}})
+        key = self.headers.get('Idempotency-Key') or str(uuid.uuid4())
+        with intents_lock:
+            if key not in intents_by_key:
+                intent_id = 'pi_' + uuid.uuid4().hex[:24]
+                intents_by_key[key] = {'id': intent_id, 'object': 'payment_intent', 'amount': amount,
+                                       'currency': form.get('currency', ['usd'])[0],
+                                       'client_secret': f'{intent_id}_secret_{uuid.uuid4().hex[:24]}'}
+            intent = intents_by_key[key]
+        self.respond(200, intent)
+
+    def respond(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8082
+    DELAY_SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    ThreadingHTTPServer(('127.0.0.1', port), PaymentIntentStub).serve_forever()
@@ -0,0 +1,46 @@
+'''
+The tests run against the database configured in .env (after `alembic upgrade head`)
+and against the local stand-ins for external APIs in scripts/, which are started on a free port per test.
+They write to that database: point .env at a scratch database of your own, never at a shared or production one.
+Run them with `python -m pytest tests`, async tests and fixtures use the pytest plugin that comes with anyio.
+'''
+from http.server import ThreadingHTTPServer
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+import maps_stub
+import stripe_stub
+from app.config import settings
+from app.clients import maps_client, stripe_client
+from app.database import engine
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+def serve(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+@pytest.fixture
+async def maps_api(monkeypatch):
+    server = serve(maps_stub.DistanceMatrixStub)
+    monkeypatch.setattr(settings, 'google_map_api_base', f'http://127.0.0.1:{server.server_port}')
+    yield server
+    server.shutdown()
+    # pooled connections belong to the event loop of this test
+    await maps_client.aclose()
+    await engine.dispose()
+
+@pytest.fixture
+async def stripe_api(monkeypatch):
+    server = serve(stripe_stub.PaymentIntentStub)
+    monkeypatch.setattr(settings, 'stripe_api_base', f'http://127.0.0.1:{server.server_port}')
+    yield server
+    server.shutdown()
+    await stripe_client.aclose()
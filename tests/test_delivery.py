@@ -0,0 +1,51 @@
+from sqlalchemy import select, delete
+import pytest
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+from app.delivery import check_addr_within_range, normalize_address
+
+pytestmark = pytest.mark.anyio
+
+async def cached_distance(customer_addr):
+    async with SessionLocal() as db:
+        return await db.scalar(select(models.DeliveryDistance)
+                               .where(models.DeliveryDistance.address == normalize_address(customer_addr)))
+
+@pytest.fixture
+async def address(request):
+    customer_addr = request.param
+    async with SessionLocal() as db:
+        await db.execute(delete(models.DeliveryDistance).where(models.DeliveryDistance.address == normalize_address(customer_addr)))
+        await db.commit()
+    yield customer_addr
+    async with SessionLocal() as db:
+        await db.execute(delete(models.DeliveryDistance).where(models.DeliveryDistance.address == normalize_address(customer_addr)))
+        await db.commit()
+
+# the stub puts every address 1 mile away per 1000 of its zip code
+@pytest.mark.parametrize('address', ['1 Test Street, Springfield, CA 02000'], indirect=True)
+async def test_address_in_range_is_cached(maps_api, address, monkeypatch):
+    monkeypatch.setattr(settings, 'delivery_range', 5)
+    assert await check_addr_within_range(address) == (True, '')
+    assert (await cached_distance(address)).distance_miles == pytest.approx(2, abs=0.01)
+    # another spelling of the same address is answered from the cache, without the API
+    maps_api.shutdown()
+    maps_api.server_close()
+    assert await check_addr_within_range('1 test st springfield ca 02000') == (True, '')
+
+@pytest.mark.parametrize('address', ['1 Test Street, Springfield, CA 90000'], indirect=True)
+async def test_address_out_of_range(maps_api, address, monkeypatch):
+    monkeypatch.setattr(settings, 'delivery_range', 5)
+    assert await check_addr_within_range(address) == (False, 'Sorry, the address you entered is out of our delivery range.')
+
+@pytest.mark.parametrize('address', ['1 Nowhere Road, Springfield, CA 01000'], indirect=True)
+async def test_address_not_found_is_cached(maps_api, address):
+    assert await check_addr_within_range(address) == (False, 'The address you entered could not be found.')
+    assert (await cached_distance(address)).distance_miles == None
+
+@pytest.mark.parametrize('address', ['1 Test Street, Springfield, CA 03000'], indirect=True)
+async def test_failed_lookup_is_not_cached(maps_api, address, monkeypatch):
+    monkeypatch.setattr(settings, 'google_map_api_key', 'fail')
+    assert await check_addr_within_range(address) == (False, 'Sorry, something went wrong.')
+    assert await cached_distance(address) == None
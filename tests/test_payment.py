@@ -0,0 +1,20 @@
+import pytest
+from app.utils import create_payment_intent, PaymentError
+
+pytestmark = pytest.mark.anyio
+
+async def test_payment_intent_is_created(stripe_api):
+    client_secret = await create_payment_intent(2599, 'customer@example.com', 'order 1', 'order-1-payment-intent')
+    assert client_secret.startswith('pi_') and '_secret_' in client_secret
+
+async def test_retry_with_same_key_returns_same_intent(stripe_api):
+    first = await create_payment_intent(2599, 'customer@example.com', 'order 2', 'order-2-payment-intent')
+    retried = await create_payment_intent(2599, 'customer@example.com', 'order 2', 'order-2-payment-intent')
+    other = await create_payment_intent(2599, 'customer@example.com', 'order 3', 'order-3-payment-intent')
+    assert retried == first
+    assert other != first
+
+async def test_rejected_intent_raises_payment_error(stripe_api):
+    # the stub, like Stripe, rejects amounts below 50 cents
+    with pytest.raises(PaymentError, match='at least'):
+        await create_payment_intent(10, 'customer@example.com', 'order 4', 'order-4-payment-intent')